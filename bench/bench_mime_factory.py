@@ -0,0 +1,82 @@
+'''
+This script benchmarks building campaign emails with the pre-serialized
+CampaignMessageFactory against the previous per-recipient MIMEMultipart path,
+and checks that both produce the same parsed message.
+
+Usage:
+python bench/bench_mime_factory.py [recipients]
+'''
+
+import sys
+import os
+import time
+from email import message_from_bytes
+from email.header import Header, decode_header, make_header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Get the absolute path to the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+from mime_factory import CampaignMessageFactory, wrap_html
+
+SUBJECT = "This week at BullRunAI 🚀"
+ADVERTISEMENT_HTML = "<p>Join the early access program today!</p>"
+FROM_NAME = "BullRunAI"
+FROM_EMAIL = "founders@bullrunai.app"
+TEMPLATE = "<h1>Hi {{name}},</h1>" + "<p>Market recap and ideas from the community.</p>" * 40
+
+
+def build_with_mime(to_email, to_name, html_content):
+    """The previous send_email_smtp path: a fresh MIME tree serialized per recipient"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = Header(SUBJECT, 'utf-8')
+    msg['From'] = f"{FROM_NAME} <{FROM_EMAIL}>"
+    msg['To'] = f"{to_name} <{to_email}>"
+    msg.attach(MIMEText(wrap_html(SUBJECT, html_content, ADVERTISEMENT_HTML), 'html', 'utf-8'))
+    return msg.as_bytes()
+
+
+def build_with_factory(factory, to_email, to_name, html_content):
+    return factory.render(to_email, to_name, html_content)
+
+
+def _summary(raw):
+    parsed = message_from_bytes(raw)
+    part = parsed.get_payload()[0]
+    return (
+        str(make_header(decode_header(parsed['Subject']))),
+        parsed['To'],
+        part.get_content_type(),
+        part.get_payload(decode=True),
+    )
+
+
+def run_benchmark(recipients=2000):
+    people = [(f"subscriber{i}@example.com", f"subscriber {i}") for i in range(recipients)]
+
+    started = time.perf_counter()
+    for email, name in people:
+        build_with_mime(email, name, TEMPLATE.replace('{{name}}', name))
+    mime_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    factory = CampaignMessageFactory(SUBJECT, ADVERTISEMENT_HTML, FROM_NAME, FROM_EMAIL)
+    for email, name in people:
+        build_with_factory(factory, email, name, TEMPLATE.replace('{{name}}', name))
+    factory_seconds = time.perf_counter() - started
+
+    email, name = people[0]
+    content = TEMPLATE.replace('{{name}}', name)
+    same = _summary(build_with_mime(email, name, content)) == _summary(factory.render(email, name, content))
+
+    print(f"📨 Recipients:          {recipients}")
+    print(f"🐢 MIMEMultipart path:  {mime_seconds * 1000:.1f} ms ({mime_seconds / recipients * 1e6:.1f} µs/message)")
+    print(f"⚡ Factory path:        {factory_seconds * 1000:.1f} ms ({factory_seconds / recipients * 1e6:.1f} µs/message)")
+    print(f"📈 Speedup:             {mime_seconds / factory_seconds:.1f}x")
+    print(f"✅ Equivalent output:   {same}")
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,140 @@
+import os
+import json
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Conditional and compressed JSON responses for read endpoints. Responses are
+# keyed by a cheap version tag of the underlying data: a matching If-None-Match
+# gets a 304 without touching the data at all, and serialized/compressed bodies
+# are cached per version so unchanged data is never re-serialized or recompressed.
+
+MIN_COMPRESS_BYTES = 1024
+_MAX_CACHED_BODIES = 32
+# Total size of all cached bodies; a large subscriber list is cached once per encoding
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+_bodies = OrderedDict()
+_bodies_bytes = 0
+_bodies_lock = threading.Lock()
+
+
+def make_etag(resource, version):
+    digest = hashlib.sha1(f"{resource}:{version}".encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison: W/"x" and "x" are the same representation version
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def choose_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header, honoring q=0"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return 'identity'
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def _serialize(payload):
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def _cached_body(etag, encoding, build):
+    global _bodies_bytes
+    key = (etag, encoding)
+    with _bodies_lock:
+        body = _bodies.get(key)
+        if body is not None:
+            _bodies.move_to_end(key)
+            return body
+    body = build()
+    if len(body) > RESPONSE_CACHE_MAX_BYTES:
+        return body
+    with _bodies_lock:
+        previous = _bodies.pop(key, None)
+        if previous is not None:
+            _bodies_bytes -= len(previous)
+        _bodies[key] = body
+        _bodies_bytes += len(body)
+        # Evict least recently used bodies until both the count and byte budgets hold
+        while len(_bodies) > _MAX_CACHED_BODIES or _bodies_bytes > RESPONSE_CACHE_MAX_BYTES:
+            _, evicted = _bodies.popitem(last=False)
+            _bodies_bytes -= len(evicted)
+    return body
+
+
+def conditional_json_response(request, headers, resource, version, build_payload):
+    """Return a (body, status, headers) tuple honoring If-None-Match and Accept-Encoding.
+
+    build_payload is only called when no serialized body is cached for this version.
+    When the data revision is unknown (version is None), the tag is derived from the
+    serialized body itself, which still saves bandwidth on unchanged data.
+    """
+    raw = None
+    if version is None:
+        raw = _serialize(build_payload())
+        version = hashlib.sha1(raw).hexdigest()
+    etag = make_etag(resource, version)
+    response_headers = dict(headers)
+    response_headers['ETag'] = etag
+    response_headers['Cache-Control'] = 'no-cache'
+    response_headers['Vary'] = 'Accept-Encoding'
+
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        return ('', 304, response_headers)
+
+    if raw is None:
+        raw = _cached_body(etag, 'identity', lambda: _serialize(build_payload()))
+
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding != 'identity' and len(raw) >= MIN_COMPRESS_BYTES:
+        body = _cached_body(etag, encoding, lambda: _compress(raw, encoding))
+        response_headers['Content-Encoding'] = encoding
+    else:
+        body = raw
+
+    response_headers['Content-Type'] = 'application/json'
+    return (body, 200, response_headers)
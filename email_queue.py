@@ -0,0 +1,353 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from datetime import datetime
+
+from resilience import TokenBucket, DependencyUnavailable
+
+# Durable outbound email queue. Welcome and campaign mail share one SQLite-backed
+# queue; workers always claim the highest-priority due message whose recipient
+# domain still has send budget, so transactional mail preempts campaign bursts.
+
+EMAIL_QUEUE_DB_PATH = os.getenv('EMAIL_QUEUE_DB_PATH', '/tmp/subscriber_email_queue.db')
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', '4'))
+# Workers reserved for welcome mail so it never waits behind a campaign send
+EMAIL_PRIORITY_WORKERS = int(os.getenv('EMAIL_PRIORITY_WORKERS', '1'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_DOMAIN_RATE_PER_MINUTE = int(os.getenv('EMAIL_DOMAIN_RATE_PER_MINUTE', '120'))
+# Per-domain overrides, e.g. "gmail.com=60,outlook.com=30"
+EMAIL_DOMAIN_RATES = os.getenv('EMAIL_DOMAIN_RATES', '')
+
+PRIORITY_WELCOME = 0
+PRIORITY_CAMPAIGN = 10
+
+RETRY_BASE_DELAY = 30.0
+RETRY_MAX_DELAY = 3600.0
+
+
+class PermanentSendError(Exception):
+    """Raised by a sender when retrying cannot help (5xx reply, refused recipient, bad credentials)"""
+
+
+class UncertainDeliveryError(Exception):
+    """Raised by a sender when the relay may already have accepted the message (e.g. a disconnect
+    after DATA). Such messages are never resent automatically, since that could duplicate them."""
+
+OUTCOME_FAILED = 'failed'
+OUTCOME_UNCERTAIN = 'uncertain'
+
+
+def _parse_domain_rates(spec):
+    rates = {}
+    for item in spec.split(','):
+        if '=' in item:
+            domain, rate = item.split('=', 1)
+            rates[domain.strip().lower()] = int(rate)
+    return rates
+
+
+def email_domain(email):
+    return email.rsplit('@', 1)[-1].strip().lower() if '@' in email else ''
+
+
+class EmailQueue:
+    """SQLite-backed priority queue with per-domain rate shaping, retries and a dead-letter store.
+
+    The sender returns normally on success and raises on failure: PermanentSendError
+    dead-letters the message at once, UncertainDeliveryError dead-letters it as
+    'uncertain' (delivery is at most once past that point), DependencyUnavailable
+    (relay never contacted) requeues it without using an attempt, and anything else
+    is retried with backoff.
+    """
+
+    def __init__(self, sender, path=EMAIL_QUEUE_DB_PATH, workers=EMAIL_WORKERS,
+                 priority_workers=EMAIL_PRIORITY_WORKERS, max_attempts=EMAIL_MAX_ATTEMPTS):
+        self.sender = sender
+        self.path = path
+        self.workers = workers
+        self.priority_workers = min(priority_workers, workers)
+        self.max_attempts = max_attempts
+        self._domain_rates = _parse_domain_rates(EMAIL_DOMAIN_RATES)
+        self._domain_buckets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._stopping = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbound_email (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER NOT NULL,
+                campaign TEXT,
+                domain TEXT NOT NULL,
+                to_email TEXT NOT NULL,
+                to_name TEXT,
+                subject TEXT NOT NULL,
+                html_content TEXT NOT NULL,
+                advertisement_html TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                last_error TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outbound_email_due
+                ON outbound_email (status, priority, next_attempt_at, id);
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                campaign TEXT,
+                to_email TEXT NOT NULL,
+                to_name TEXT,
+                subject TEXT NOT NULL,
+                html_content TEXT NOT NULL,
+                advertisement_html TEXT,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                failed_at TEXT NOT NULL,
+                outcome TEXT NOT NULL DEFAULT 'failed'
+            );
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(dead_letters)")]
+        if 'outcome' not in columns:
+            self._conn.execute("ALTER TABLE dead_letters ADD COLUMN outcome TEXT NOT NULL DEFAULT 'failed'")
+        # A message claimed by a process that died mid-send may already have been
+        # delivered, so it is parked as uncertain rather than sent a second time
+        for (message_id,) in self._conn.execute(
+            "SELECT id FROM outbound_email WHERE status = 'sending'"
+        ).fetchall():
+            self._dead_letter(message_id, None, 'interrupted while sending', OUTCOME_UNCERTAIN)
+        self._conn.commit()
+
+    def _bucket(self, domain):
+        bucket = self._domain_buckets.get(domain)
+        if bucket is None:
+            rate = self._domain_rates.get(domain, EMAIL_DOMAIN_RATE_PER_MINUTE)
+            bucket = TokenBucket(rate / 60.0, max(1, rate // 6))
+            self._domain_buckets[domain] = bucket
+        return bucket
+
+    def enqueue(self, to_email, to_name, subject, html_content, advertisement_html='',
+                priority=PRIORITY_CAMPAIGN, campaign=None):
+        return self.enqueue_many([(to_email, to_name, html_content)], subject,
+                                 advertisement_html, priority, campaign)
+
+    def send_now(self, to_email, to_name, subject, html_content, advertisement_html='',
+                 priority=PRIORITY_WELCOME, campaign=None):
+        """Queue a message and deliver it on the calling thread if its domain has send budget.
+
+        Serverless hosts throttle CPU once the response is sent, so mail that must go
+        out with the request can't wait for the background workers. The row is written
+        first, so a throttled or failed send is still retried by the workers.
+        Returns True when the message was delivered here.
+        """
+        now = time.time()
+        domain = email_domain(to_email)
+        with self._lock:
+            claimed = self._bucket(domain).acquire(timeout=0)
+            cursor = self._conn.execute(
+                "INSERT INTO outbound_email (priority, campaign, domain, to_email, to_name, subject, "
+                "html_content, advertisement_html, next_attempt_at, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (priority, campaign, domain, to_email, to_name, subject, html_content, advertisement_html,
+                 now, 'sending' if claimed else 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            )
+            self._conn.commit()
+            if not claimed:
+                self._wakeup.notify_all()
+        self.start()
+        if not claimed:
+            return False
+        return self._attempt((cursor.lastrowid, priority, to_email, to_name, subject, html_content,
+                              advertisement_html, 0))
+
+    def enqueue_many(self, recipients, subject, advertisement_html='',
+                     priority=PRIORITY_CAMPAIGN, campaign=None):
+        """Queue recipients in a single transaction.
+
+        Each recipient is (to_email, to_name, html_content) or, for scheduled
+        delivery, (to_email, to_name, html_content, not_before_epoch_seconds).
+        """
+        now = time.time()
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+        for recipient in recipients:
+            to_email, to_name, html_content = recipient[:3]
+            not_before = recipient[3] if len(recipient) > 3 and recipient[3] else now
+            rows.append((priority, campaign, email_domain(to_email), to_email, to_name, subject,
+                         html_content, advertisement_html, not_before, created_at))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO outbound_email (priority, campaign, domain, to_email, to_name, subject, "
+                "html_content, advertisement_html, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._wakeup.notify_all()
+        self.start()
+        return len(rows)
+
+    def _claim(self, max_priority=None):
+        """Claim the highest-priority due message whose domain has send budget (caller holds the lock)"""
+        now = time.time()
+        throttled = set()
+        while True:
+            # Throttled domains are excluded in SQL so a backlog for one domain
+            # can never fill the candidate window and starve every other domain
+            sql = "SELECT id, domain FROM outbound_email WHERE status = 'pending' AND next_attempt_at <= ?"
+            params = [now]
+            if max_priority is not None:
+                sql += " AND priority <= ?"
+                params.append(max_priority)
+            if throttled:
+                sql += f" AND domain NOT IN ({','.join('?' * len(throttled))})"
+                params.extend(throttled)
+            sql += " ORDER BY priority, next_attempt_at, id LIMIT 100"
+
+            candidates = self._conn.execute(sql, params).fetchall()
+            if not candidates:
+                return None
+            for message_id, domain in candidates:
+                if domain in throttled:
+                    continue
+                if not self._bucket(domain).acquire(timeout=0):
+                    throttled.add(domain)
+                    continue
+                self._conn.execute("UPDATE outbound_email SET status = 'sending' WHERE id = ?", (message_id,))
+                self._conn.commit()
+                return self._conn.execute(
+                    "SELECT id, priority, to_email, to_name, subject, html_content, advertisement_html, attempts "
+                    "FROM outbound_email WHERE id = ?", (message_id,)
+                ).fetchone()
+
+    def _complete(self, message_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbound_email WHERE id = ?", (message_id,))
+            self._conn.commit()
+
+    def _dead_letter(self, message_id, attempts, error, outcome=OUTCOME_FAILED):
+        """Move a message to dead_letters (caller holds the lock); attempts=None keeps the stored count"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dead_letters (id, priority, campaign, to_email, to_name, subject, "
+            "html_content, advertisement_html, attempts, last_error, created_at, failed_at, outcome) "
+            "SELECT id, priority, campaign, to_email, to_name, subject, html_content, advertisement_html, "
+            "COALESCE(?, attempts + 1), ?, created_at, ?, ? FROM outbound_email WHERE id = ?",
+            (attempts, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), outcome, message_id),
+        )
+        self._conn.execute("DELETE FROM outbound_email WHERE id = ?", (message_id,))
+
+    def _fail(self, message_id, attempts, error, permanent=False, outcome=OUTCOME_FAILED):
+        with self._lock:
+            if permanent or attempts >= self.max_attempts:
+                self._dead_letter(message_id, attempts, error, outcome)
+            else:
+                # Equal jitter: spread retries out without ever retrying almost immediately
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempts))
+                delay = random.uniform(delay / 2, delay)
+                self._conn.execute(
+                    "UPDATE outbound_email SET status = 'pending', attempts = ?, last_error = ?, "
+                    "next_attempt_at = ? WHERE id = ?",
+                    (attempts, error, time.time() + delay, message_id),
+                )
+            self._conn.commit()
+
+    def _defer(self, message_id, delay, error):
+        """Requeue a message that never reached the relay, without using up an attempt"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbound_email SET status = 'pending', last_error = ?, next_attempt_at = ? WHERE id = ?",
+                (error, time.time() + delay, message_id),
+            )
+            self._conn.commit()
+
+    def _attempt(self, message):
+        """Send one claimed message and record the outcome; returns True when it was delivered"""
+        message_id, priority, to_email, to_name, subject, html_content, advertisement_html, attempts = message
+        try:
+            self.sender(to_email, to_name, subject, html_content, advertisement_html or '')
+        except DependencyUnavailable as e:
+            # Open circuit or local rate limit: the relay was never contacted
+            self._defer(message_id, max(1.0, e.retry_after or RETRY_BASE_DELAY), f"{type(e).__name__}: {e}")
+            return False
+        except UncertainDeliveryError as e:
+            print(f"⚠️ Delivery to {to_email} is uncertain, not retrying: {e}")
+            self._fail(message_id, attempts + 1, f"{type(e).__name__}: {e}", permanent=True,
+                       outcome=OUTCOME_UNCERTAIN)
+            return False
+        except PermanentSendError as e:
+            print(f"❌ Permanent failure sending email to {to_email}: {e}")
+            self._fail(message_id, attempts + 1, f"{type(e).__name__}: {e}", permanent=True)
+            return False
+        except Exception as e:
+            print(f"⚠️ Failed to send queued email to {to_email} (attempt {attempts + 1}): {e}")
+            self._fail(message_id, attempts + 1, f"{type(e).__name__}: {e}")
+            return False
+        self._complete(message_id)
+        return True
+
+    def _worker(self, max_priority):
+        while not self._stopping:
+            with self._lock:
+                message = self._claim(max_priority)
+                if message is None:
+                    self._wakeup.wait(timeout=1.0)
+                    continue
+            self._attempt(message)
+
+    def start(self):
+        """Start the worker pool if it isn't running yet"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                max_priority = PRIORITY_WELCOME if i < self.priority_workers else None
+                thread = threading.Thread(target=self._worker, args=(max_priority,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopping = True
+        with self._lock:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        self._stopping = False
+
+    def stats(self):
+        with self._lock:
+            # Pending messages that aren't due yet are scheduled campaign waves (or retry backoff)
+            queued = self._conn.execute(
+                "SELECT priority, CASE WHEN status = 'pending' AND next_attempt_at > ? "
+                "THEN 'scheduled' ELSE status END AS state, COUNT(*) "
+                "FROM outbound_email GROUP BY priority, state",
+                (time.time(),),
+            ).fetchall()
+            dead = dict(self._conn.execute("SELECT outcome, COUNT(*) FROM dead_letters GROUP BY outcome").fetchall())
+        names = {PRIORITY_WELCOME: 'welcome', PRIORITY_CAMPAIGN: 'campaign'}
+        return {
+            'queued': [
+                {'priority': names.get(priority, priority), 'status': status, 'count': count}
+                for priority, status, count in queued
+            ],
+            'dead_letters': sum(dead.values()),
+            'uncertain_deliveries': dead.get(OUTCOME_UNCERTAIN, 0),
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_email_queue(sender):
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = EmailQueue(sender)
+                _queue.start()
+    return _queue
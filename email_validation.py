@@ -0,0 +1,212 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import dns.resolver
+    import dns.exception
+except ImportError:  # without dnspython only syntax and disposable-domain checks run
+    dns = None
+
+# Deliverability checks run before a subscriber is stored or mailed: RFC syntax,
+# a disposable-domain blocklist and an MX lookup through a TTL-cached resolver
+# that also caches negative answers. Set EMAIL_DNS_NAMESERVERS (e.g.
+# "127.0.0.1:5353") to point lookups at a local DNS stub.
+
+EMAIL_DNS_NAMESERVERS = os.getenv('EMAIL_DNS_NAMESERVERS', '')
+EMAIL_DNS_TIMEOUT = float(os.getenv('EMAIL_DNS_TIMEOUT', '2.0'))
+EMAIL_DNS_MIN_TTL = int(os.getenv('EMAIL_DNS_MIN_TTL', '300'))
+EMAIL_DNS_MAX_TTL = int(os.getenv('EMAIL_DNS_MAX_TTL', '86400'))
+EMAIL_DNS_NEGATIVE_TTL = int(os.getenv('EMAIL_DNS_NEGATIVE_TTL', '900'))
+EMAIL_DNS_CACHE_SIZE = int(os.getenv('EMAIL_DNS_CACHE_SIZE', '50000'))
+EMAIL_CHECK_MX = os.getenv('EMAIL_CHECK_MX', 'true').lower() == 'true'
+# Largest list accepted by POST /validate-emails
+VALIDATE_EMAILS_MAX = int(os.getenv('VALIDATE_EMAILS_MAX', '1000'))
+# Optional newline-separated file of extra disposable domains
+DISPOSABLE_DOMAINS_FILE = os.getenv('DISPOSABLE_DOMAINS_FILE', '')
+
+INVALID_SYNTAX = 'invalid_syntax'
+DISPOSABLE_DOMAIN = 'disposable_domain'
+NO_MX = 'no_mail_server'
+
+_ATOM = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LOCAL_PART = re.compile(rf"^{_ATOM}(\.{_ATOM})*$")
+_DOMAIN_LABEL = re.compile(r"^[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?$")
+_TLD = re.compile(r"^([A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})$")
+
+DISPOSABLE_DOMAINS = frozenset([
+    '10minutemail.com', '20minutemail.com', 'discard.email', 'dispostable.com',
+    'emailondeck.com', 'fakeinbox.com', 'getairmail.com', 'getnada.com',
+    'guerrillamail.biz', 'guerrillamail.com', 'guerrillamail.de', 'guerrillamail.net',
+    'guerrillamail.org', 'guerrillamailblock.com', 'harakirimail.com', 'incognitomail.org',
+    'mailcatch.com', 'maildrop.cc', 'mailinator.com', 'mailinator.net', 'mailnesia.com',
+    'mintemail.com', 'mohmal.com', 'mytemp.email', 'sharklasers.com', 'spam4.me',
+    'spamgourmet.com', 'temp-mail.io', 'temp-mail.org', 'tempail.com', 'tempinbox.com',
+    'tempmail.com', 'tempmail.dev', 'tempmailo.com', 'tempr.email', 'throwawaymail.com',
+    'trashmail.com', 'trashmail.de', 'yopmail.com', 'yopmail.fr', 'yopmail.net',
+])
+
+
+def _load_disposable_domains():
+    domains = set(DISPOSABLE_DOMAINS)
+    if DISPOSABLE_DOMAINS_FILE and os.path.exists(DISPOSABLE_DOMAINS_FILE):
+        with open(DISPOSABLE_DOMAINS_FILE) as f:
+            domains.update(line.strip().lower() for line in f if line.strip() and not line.startswith('#'))
+    return frozenset(domains)
+
+
+_disposable_domains = _load_disposable_domains()
+
+
+def check_syntax(email):
+    """Return (local_part, domain) for a syntactically valid address, else None"""
+    if not email or len(email) > 254 or email.count('@') != 1:
+        return None
+    local_part, domain = email.rsplit('@', 1)
+    if not local_part or len(local_part) > 64 or not _LOCAL_PART.match(local_part):
+        return None
+    domain = domain.rstrip('.').lower()
+    labels = domain.split('.')
+    if len(labels) < 2 or not all(_DOMAIN_LABEL.match(label) for label in labels):
+        return None
+    if not _TLD.match(labels[-1]):
+        return None
+    return local_part, domain
+
+
+def is_disposable(domain):
+    # Match the domain and every parent, so sub.mailinator.com is caught too
+    labels = domain.split('.')
+    return any('.'.join(labels[i:]) in _disposable_domains for i in range(len(labels) - 1))
+
+
+class MXResolver:
+    """MX lookups with per-answer TTL caching and negative caching of missing domains"""
+
+    def __init__(self, nameservers=EMAIL_DNS_NAMESERVERS, timeout=EMAIL_DNS_TIMEOUT):
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._resolver = None
+        if dns is not None:
+            self._resolver = dns.resolver.Resolver(configure=not nameservers)
+            if nameservers:
+                hosts = []
+                for server in nameservers.split(','):
+                    host, _, port = server.strip().partition(':')
+                    hosts.append(host)
+                    if port:
+                        self._resolver.port = int(port)
+                self._resolver.nameservers = hosts
+            self._resolver.timeout = timeout
+            self._resolver.lifetime = timeout
+
+    def _cached(self, domain):
+        with self._lock:
+            entry = self._cache.get(domain)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def _store(self, domain, has_mail_server, ttl):
+        with self._lock:
+            if len(self._cache) >= EMAIL_DNS_CACHE_SIZE:
+                now = time.monotonic()
+                for key in [k for k, (_, expires) in self._cache.items() if expires <= now]:
+                    del self._cache[key]
+                if len(self._cache) >= EMAIL_DNS_CACHE_SIZE:
+                    self._cache.pop(next(iter(self._cache)))
+            self._cache[domain] = (has_mail_server, time.monotonic() + ttl)
+
+    def _lookup(self, domain, rdtype):
+        answer = self._resolver.resolve(domain, rdtype)
+        return answer.rrset.ttl if answer.rrset is not None else EMAIL_DNS_MIN_TTL
+
+    def has_mail_server(self, domain, cached_only=False):
+        """True/False for a definitive answer, None when DNS could not say (fail open).
+
+        With cached_only, only previously cached answers are used and no lookup is made.
+        """
+        if self._resolver is None:
+            return None
+        cached = self._cached(domain)
+        if cached is not None or cached_only:
+            return cached
+
+        try:
+            ttl = self._lookup(domain, 'MX')
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            # RFC 5321 implicit MX: a domain with only an A record still accepts mail
+            try:
+                ttl = self._lookup(domain, 'A')
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                self._store(domain, False, EMAIL_DNS_NEGATIVE_TTL)
+                return False
+            except dns.exception.DNSException:
+                return None
+        except dns.exception.DNSException:
+            # Timeouts and SERVFAIL are not cached: the domain may be fine
+            return None
+
+        self._store(domain, True, min(max(ttl, EMAIL_DNS_MIN_TTL), EMAIL_DNS_MAX_TTL))
+        return True
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_mx_resolver():
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = MXResolver()
+    return _resolver
+
+
+def validate_email_address(email, check_mx=EMAIL_CHECK_MX):
+    """Return (valid, reason) for one address; reason is None when valid"""
+    parsed = check_syntax((email or '').strip())
+    if parsed is None:
+        return False, INVALID_SYNTAX
+    _, domain = parsed
+    if is_disposable(domain):
+        return False, DISPOSABLE_DOMAIN
+    if check_mx and get_mx_resolver().has_mail_server(domain) is False:
+        return False, NO_MX
+    return True, None
+
+
+def validate_email_addresses(emails, check_mx=EMAIL_CHECK_MX, max_workers=16, cached_only=False):
+    """Validate many addresses, resolving each distinct domain once in parallel.
+
+    With cached_only, MX results come from the resolver cache alone and uncached
+    domains are treated as deliverable. Returns {email: (valid, reason)}.
+    """
+    results, pending = {}, {}
+    for email in emails:
+        parsed = check_syntax((email or '').strip())
+        if parsed is None:
+            results[email] = (False, INVALID_SYNTAX)
+        elif is_disposable(parsed[1]):
+            results[email] = (False, DISPOSABLE_DOMAIN)
+        else:
+            pending.setdefault(parsed[1], []).append(email)
+
+    if check_mx and pending and cached_only:
+        resolver = get_mx_resolver()
+        answers = {domain: resolver.has_mail_server(domain, cached_only=True) for domain in pending}
+    elif check_mx and pending:
+        resolver = get_mx_resolver()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+            answers = dict(zip(pending, pool.map(resolver.has_mail_server, pending)))
+    else:
+        answers = {}
+
+    for domain, domain_emails in pending.items():
+        result = (False, NO_MX) if answers.get(domain) is False else (True, None)
+        for email in domain_emails:
+            results[email] = result
+    return results
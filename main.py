@@ -1,51 +1,131 @@
+import time
+_MODULE_LOAD_STARTED = time.perf_counter()
 import os
+import sys
 import json
+import importlib
+import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import requests
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.header import Header
-SHEET_ID = "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c"
+from rollups import get_rollup_store, record_to_row
+from email_queue import get_email_queue, PermanentSendError, UncertainDeliveryError, PRIORITY_WELCOME, PRIORITY_CAMPAIGN, EMAIL_QUEUE_DB_PATH
+from segments import compile_segment, select_audience, SegmentError
+from scheduler import plan_waves, release_schedule, parse_send_at, parse_local_time, ScheduleError
+from sharding import get_shard_router
+from conditional import conditional_json_response
+from ratelimit import check_subscribe_limits
+from tracking import get_tracker, tracking_enabled, verify_token, instrument_html, rewrite_links, PIXEL_GIF, OPEN, CLICK
+from resilience import resilient_call, DependencyUnavailable, RETRYABLE_HTTP_STATUSES, dependency_status
+SHEET_ID = os.getenv('GOOGLE_SHEET_ID', "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c")
+
+# Heavy dependencies (gspread, oauth2client, requests, googleapiclient, SMTP/MIME)
+# are imported on first use so cold starts only pay for what a request needs.
+IMPORT_TIMINGS = {}
+
+def _import(module_name):
+    """Import a module on first use and record how long the import took"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        IMPORT_TIMINGS[module_name] = round((time.perf_counter() - started) * 1000, 2)
+    return module
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag'])
 
 # Google Sheets setup
+_sheets_client = None
+_sheets_client_lock = threading.Lock()
+
 def init_google_sheets():
-    try:
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/drive",
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive.readonly",
-        ]
+    """Return a process-wide gspread client, authorizing it on first use"""
+    global _sheets_client
+    if _sheets_client is not None:
+        return _sheets_client
+    
+    with _sheets_client_lock:
+        if _sheets_client is not None:
+            return _sheets_client
+        try:
+            scope = [
+                "https://spreadsheets.google.com/feeds",
+                "https://www.googleapis.com/auth/drive",
+                "https://www.googleapis.com/auth/spreadsheets",
+                "https://www.googleapis.com/auth/drive.readonly",
+            ]
 
-        # Load from environment variable GOOGLE_CREDENTIALS
-        credentials_json = os.getenv("GOOGLE_CREDENTIALS")
-        if not credentials_json:
-            raise Exception("Missing GOOGLE_CREDENTIALS env var")
+            # Load from environment variable GOOGLE_CREDENTIALS
+            credentials_json = os.getenv("GOOGLE_CREDENTIALS")
+            if not credentials_json:
+                raise Exception("Missing GOOGLE_CREDENTIALS env var")
 
-        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            json.loads(credentials_json), scope
-        )
+            gspread = _import('gspread')
+            service_account = _import('oauth2client.service_account')
+            credentials = service_account.ServiceAccountCredentials.from_json_keyfile_dict(
+                json.loads(credentials_json), scope
+            )
+
+            _sheets_client = gspread.authorize(credentials)
+            return _sheets_client
+
+        except Exception as e:
+            print(f"Error initializing Google Sheets: {e}")
+            return None
+
+# Google Drive setup
+# googleapiclient's httplib2 transport is not thread-safe, so every thread gets its
+# own service object; the discovery document is loaded once and shared
+_drive_discovery_doc = None
+_drive_discovery_lock = threading.Lock()
+_drive_services = threading.local()
 
-        client = gspread.authorize(credentials)
-        return client
+def get_drive_service(client):
+    """Return this thread's Drive v3 service built from the bundled static discovery document"""
+    global _drive_discovery_doc
+    service = getattr(_drive_services, 'service', None)
+    if service is not None:
+        return service
+    
+    discovery = _import('googleapiclient.discovery')
+    if _drive_discovery_doc is None:
+        with _drive_discovery_lock:
+            if _drive_discovery_doc is None:
+                _drive_discovery_doc = _import('googleapiclient.discovery_cache').get_static_doc('drive', 'v3')
+    
+    service = discovery.build_from_document(_drive_discovery_doc, credentials=client.auth)
+    _drive_services.service = service
+    return service
 
+def prewarm_clients():
+    """Authorize Google clients ahead of the first request"""
+    try:
+        started = time.perf_counter()
+        client = init_google_sheets()
+        if client:
+            get_drive_service(client)
+            get_shard_router(client, SHEET_ID).fan_out(lambda worksheet: worksheet)
+        _import('requests')
+        _import('smtplib')
+        _import('mime_factory')
+        print(f"✅ Prewarmed clients in {(time.perf_counter() - started) * 1000:.0f} ms")
     except Exception as e:
-        print(f"Error initializing Google Sheets: {e}")
-        return None
+        print(f"⚠️ Error prewarming clients: {e}")
 
 # IP location function
 def get_ip_location(ip_address):
     try:
-        response = requests.get(f'http://ip-api.com/json/{ip_address}', timeout=3)
+        requests = _import('requests')
+        
+        def fetch():
+            response = requests.get(f'http://ip-api.com/json/{ip_address}', timeout=3)
+            if response.status_code in RETRYABLE_HTTP_STATUSES:
+                response.raise_for_status()
+            return response
+        
+        response = resilient_call('ip-api', fetch)
         if response.status_code == 200:
             data = response.json()
             return {
@@ -102,25 +182,89 @@ def handle_send_template_email(request, headers):
     subject = data.get('subject')
     advertisement_html = data.get('advertisement_html', '')
     
-    if not template_name or not subject:
+    segment = data.get('segment')
+    dry_run = data.get('dry_run', False)
+    send_at = data.get('send_at')
+    local_send_time = data.get('local_send_time')
+    
+    if not isinstance(dry_run, bool):
+        return (jsonify({'error': 'dry_run must be true or false'}), 400, headers)
+    
+    if not dry_run and (not template_name or not subject):
         return (jsonify({'error': 'Template name and subject are required'}), 400, headers)
     
+    try:
+        segment_predicate = compile_segment(segment)
+    except SegmentError as e:
+        return (jsonify({'error': f'Invalid segment: {str(e)}'}), 400, headers)
+    
+    if send_at is not None and local_send_time is not None:
+        return (jsonify({'error': 'Use either send_at or local_send_time, not both'}), 400, headers)
+    try:
+        if send_at is not None:
+            parse_send_at(send_at)
+        if local_send_time is not None:
+            parse_local_time(local_send_time)
+    except ScheduleError as e:
+        return (jsonify({'error': str(e)}), 400, headers)
+    
     client = init_google_sheets()
     if not client:
         return (jsonify({'error': 'Failed to connect to Google Sheets'}), 500, headers)
     
+    # Get all subscribers, reading every shard in parallel
+    try:
+        subscribers = get_shard_router(client, SHEET_ID).get_all_records()
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
+    except Exception as e:
+        return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
+    
+    if not subscribers:
+        return (jsonify({'error': 'No subscribers found'}), 404, headers)
+    
+    # Narrow to the requested segment in one streaming pass
+    audience = [subscriber for subscriber in select_audience(subscribers, segment_predicate) if subscriber.get('Email')]
+    
+    # Drop undeliverable addresses; each distinct domain is resolved once through the MX cache.
+    # Dry runs only use cached MX answers so counting an audience never blocks on DNS.
+    validation = _import('email_validation').validate_email_addresses(
+        [str(subscriber['Email']) for subscriber in audience], cached_only=dry_run
+    )
+    deliverable = [subscriber for subscriber in audience if validation[str(subscriber['Email'])][0]]
+    skipped_invalid_count = len(audience) - len(deliverable)
+    audience = deliverable
+    
+    # Bucket recipients into delivery waves by their local send time
+    waves = plan_waves(audience, send_at=send_at, local_send_time=local_send_time)
+    wave_summary = [
+        {'send_at': wave_start.strftime('%Y-%m-%dT%H:%M:%SZ'), 'count': len(wave)}
+        for wave_start, wave in waves if wave
+    ]
+    
+    if dry_run:
+        return (jsonify({
+            'message': 'Dry run: no emails sent',
+            'audience_count': len(audience),
+            'skipped_invalid_count': skipped_invalid_count,
+            'total_subscribers': len(subscribers),
+            'waves': wave_summary
+        }), 200, headers)
+    
+    if not audience:
+        return (jsonify({'error': 'No subscribers match the segment'}), 404, headers)
+    
     # Initialize Google Drive client for templates
     try:
-        from googleapiclient.discovery import build
-        from googleapiclient.http import MediaIoBaseDownload
+        MediaIoBaseDownload = _import('googleapiclient.http').MediaIoBaseDownload
         import io
         
-        # Create Drive service
-        drive_service = build('drive', 'v3', credentials=client.auth)
+        # Reuse the cached Drive service
+        drive_service = get_drive_service(client)
         
         # Search for the "Html Templates" folder
         folder_query = "name='Html Templates' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-        folder_results = drive_service.files().list(q=folder_query, spaces='drive').execute()
+        folder_results = resilient_call('drive', drive_service.files().list(q=folder_query, spaces='drive').execute)
         
         if not folder_results['files']:
             return (jsonify({'error': "'Html Templates' folder not found in Google Drive"}), 404, headers)
@@ -129,7 +273,7 @@ def handle_send_template_email(request, headers):
         
         # Search for the specific template file
         file_query = f"'{templates_folder_id}' in parents and name='{template_name}' and trashed=false"
-        file_results = drive_service.files().list(q=file_query, spaces='drive').execute()
+        file_results = resilient_call('drive', drive_service.files().list(q=file_query, spaces='drive').execute)
         
         if not file_results['files']:
             return (jsonify({'error': f"Template '{template_name}' not found in 'Html Templates' folder"}), 404, headers)
@@ -142,53 +286,146 @@ def handle_send_template_email(request, headers):
         downloader = MediaIoBaseDownload(fh, request_download)
         done = False
         while done is False:
-            status, done = downloader.next_chunk()
+            status, done = resilient_call('drive', downloader.next_chunk)
         
         template_content = fh.getvalue().decode('utf-8')
         
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
     except Exception as e:
         return (jsonify({'error': f'Error loading template from Drive: {str(e)}'}), 500, headers)
     
-    SHEET_ID = "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c"
-    # Get subscribers from Google Sheets
-    spreadsheet_name = os.getenv('GOOGLE_SHEET_NAME', 'Subscriber List')
-    try:
-        spreadsheet = client.open_by_key(SHEET_ID)
-        sheet = spreadsheet.sheet1
-    except Exception as e:
-        return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
-    
-    # Get all subscribers
-    subscribers = sheet.get_all_records()
-    if not subscribers:
-        return (jsonify({'error': 'No subscribers found'}), 404, headers)
+    # Queue emails; the outbound queue workers deliver them behind any welcome mail.
+    # Each message carries a not-before time so waves are released at a steady rate.
+    campaign_id = f"{template_name}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    recipients = []
+    track = tracking_enabled()
     
-    # Send emails
-    success_count = 0
-    failed_count = 0
+    if track:
+        # The advertisement block is shared by every recipient, so its links carry campaign-only tokens
+        advertisement_html = rewrite_links(advertisement_html, campaign_id, '')
     
-    for subscriber in subscribers:
+    for subscriber, not_before in release_schedule(waves):
         name = subscriber.get('Name', 'Subscriber')
         email = subscriber.get('Email', '')
         
-        if email:
-            # Personalize template
-            personalized_content = template_content.replace('{{name}}', name)
-            
-            if send_email_smtp(email, name, subject, personalized_content, advertisement_html):
-                success_count += 1
-            else:
-                failed_count += 1
+        # Personalize template
+        personalized_content = template_content.replace('{{name}}', name)
+        if track:
+            personalized_content = instrument_html(personalized_content, campaign_id, email)
+        recipients.append((email, name, personalized_content, not_before))
+    
+    if (send_at is not None or local_send_time is not None) and EMAIL_QUEUE_DB_PATH.startswith('/tmp/'):
+        print(f"⚠️ Campaign {campaign_id} is scheduled but EMAIL_QUEUE_DB_PATH is under /tmp; "
+              "pending waves are lost if this instance is replaced")
+    
+    queued_count = outbound_email_queue().enqueue_many(
+        recipients, subject, advertisement_html,
+        priority=PRIORITY_CAMPAIGN, campaign=campaign_id
+    )
+    if track:
+        get_tracker().record_queued(campaign_id, queued_count)
     
     return (jsonify({
-        'message': 'Email campaign completed',
-        'success_count': success_count,
-        'failed_count': failed_count
+        'message': 'Email campaign queued',
+        'campaign_id': campaign_id,
+        'queued_count': queued_count,
+        'skipped_invalid_count': skipped_invalid_count,
+        'waves': wave_summary,
+        'tracking': track
+    }), 202, headers)
+
+def outbound_email_queue():
+    """Return the durable outbound email queue, starting its workers on first use"""
+    return get_email_queue(send_email_smtp)
+
+def handle_validate_emails(request, headers):
+    """Handle bulk email deliverability checks"""
+    data = request.get_json()
+    emails = data.get('emails')
+    
+    if not isinstance(emails, list) or not emails:
+        return (jsonify({'error': 'A non-empty list of emails is required'}), 400, headers)
+    
+    email_validation = _import('email_validation')
+    if len(emails) > email_validation.VALIDATE_EMAILS_MAX:
+        return (jsonify({
+            'error': f'At most {email_validation.VALIDATE_EMAILS_MAX} emails can be validated per request'
+        }), 413, headers)
+    
+    results = email_validation.validate_email_addresses([str(email) for email in emails])
+    return (jsonify({
+        'results': [
+            {'email': email, 'valid': valid, 'reason': reason}
+            for email, (valid, reason) in results.items()
+        ],
+        'invalid_count': sum(1 for valid, _ in results.values() if not valid)
     }), 200, headers)
 
-# Function to send welcome email using subscribed.html template from Google Drive
+def handle_track_open(request, headers):
+    """Record an email open and return the tracking pixel; never touches Sheets"""
+    if not tracking_enabled():
+        return (jsonify({'error': 'Endpoint not found'}), 404, headers)
+    verified = verify_token(request.args.get('t'), OPEN)
+    if verified:
+        campaign, recipient, _ = verified
+        get_tracker().record(OPEN, campaign, recipient)
+    pixel_headers = dict(headers)
+    pixel_headers['Content-Type'] = 'image/gif'
+    pixel_headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, private'
+    # Invalid tokens still get the pixel so mail clients never show a broken image
+    return (PIXEL_GIF, 200, pixel_headers)
+
+def handle_track_click(request, headers):
+    """Record a link click and redirect to the signed destination"""
+    if not tracking_enabled():
+        return (jsonify({'error': 'Endpoint not found'}), 404, headers)
+    verified = verify_token(request.args.get('t'), CLICK)
+    if not verified:
+        return (jsonify({'error': 'Invalid tracking link'}), 400, headers)
+    campaign, recipient, url = verified
+    get_tracker().record(CLICK, campaign, recipient, url)
+    redirect_headers = dict(headers)
+    redirect_headers['Location'] = url
+    redirect_headers['Cache-Control'] = 'no-store'
+    return ('', 302, redirect_headers)
+
+def handle_campaign_stats(request, headers):
+    """Per-campaign queued/open/click counters and rates"""
+    return (jsonify(get_tracker().stats(request.args.get('campaign_id'))), 200, headers)
+
+def handle_campaign_events(request, headers):
+    """Most recent flushed open/click events for one campaign, read back from the columnar store"""
+    campaign_id = request.args.get('campaign_id')
+    if not campaign_id:
+        return (jsonify({'error': 'campaign_id is required'}), 400, headers)
+    try:
+        limit = min(max(int(request.args.get('limit', 1000)), 1), 10000)
+    except ValueError:
+        return (jsonify({'error': 'limit must be an integer'}), 400, headers)
+    
+    events = list(get_tracker().iter_events(campaign_id, limit=limit))
+    events.reverse()
+    return (jsonify({
+        'campaign_id': campaign_id,
+        'events': [
+            {
+                'timestamp': datetime.utcfromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'type': 'open' if kind == OPEN else 'click',
+                'recipient_id': recipient,
+                'url': url or None,
+            }
+            for ts, kind, _, recipient, url in events
+        ]
+    }), 200, headers)
+
+def handle_email_queue_status(request, headers):
+    """Report outbound queue depth by priority and the dead-letter count"""
+    return (jsonify(outbound_email_queue().stats()), 200, headers)
+
+# Function to queue welcome email using subscribed.html template from Google Drive
 def send_welcome_email(to_email, to_name):
-    """Send welcome email using embedded HTML template."""
+    """Queue welcome email using embedded HTML template."""
     try:
         # HTML template with placeholder for name
         template_content = """<!DOCTYPE html>
@@ -250,7 +487,15 @@ def send_welcome_email(to_email, to_name):
         subject = "Welcome to BullRunAI! 🚀"
         advertisement_html = ""  # Optional extra content if needed
 
-        return send_email_smtp(to_email, to_name, subject, personalized_content, advertisement_html)
+        # Welcome mail is sent with the request: serverless hosts throttle CPU after the
+        # response, so background workers may not run again before the instance is reclaimed.
+        # It is still queued first, so a throttled or failed send is retried by the workers.
+        if not outbound_email_queue().send_now(
+            to_email, to_name, subject, personalized_content, advertisement_html,
+            priority=PRIORITY_WELCOME
+        ):
+            print(f"⚠️ Welcome email to {to_email} left on the outbound queue")
+        return True
 
     except Exception as e:
         print(f"Error sending welcome email: {e}")
@@ -258,51 +503,71 @@ def send_welcome_email(to_email, to_name):
 
 # Email sending function
 def send_email_smtp(to_email, to_name, subject, html_content, advertisement_html):
-    try:
-        smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = int(os.getenv('SMTP_PORT', '587'))
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        from_email = os.getenv('FROM_EMAIL', smtp_username)
-        from_name = os.getenv('FROM_NAME', 'Subscriber Pipeline')
-        
-        if not all([smtp_username, smtp_password]):
-            raise Exception("SMTP credentials not configured")
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = Header(subject, 'utf-8')
-        msg['From'] = f"{from_name} <{from_email}>"
-        msg['To'] = f"{to_name} <{to_email}>"
-        
-        full_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{subject}</title>
-        </head>
-        <body style="font-family: Arial, sans-serif; line-height: 1; color: #333; margin: 0 auto; padding: 2px;">
-            {html_content}
-            <hr style="margin: 30px 0; border: none; border-top: 1px solid #eee;">
-            {advertisement_html}
-        </body>
-        </html>
-        """
-        
-        html_part = MIMEText(full_html, 'html', 'utf-8')
-        msg.attach(html_part)
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
+    """Deliver one email; raises on failure so the outbound queue can classify it.
+
+    PermanentSendError means retrying cannot help, UncertainDeliveryError means the
+    relay may already have the message, DependencyUnavailable means the relay was
+    never contacted, and any other exception is a transient failure.
+    """
+    smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+    smtp_port = int(os.getenv('SMTP_PORT', '587'))
+    smtp_username = os.getenv('SMTP_USERNAME')
+    smtp_password = os.getenv('SMTP_PASSWORD')
+    from_email = os.getenv('FROM_EMAIL', smtp_username)
+    from_name = os.getenv('FROM_NAME', 'Subscriber Pipeline')
+    
+    if not all([smtp_username, smtp_password]):
+        raise PermanentSendError("SMTP credentials not configured")
+    
+    smtplib = _import('smtplib')
+    get_message_factory = _import('mime_factory').get_message_factory
+    
+    # Invariant headers and wrapper are serialized once per subject/advertisement
+    factory = get_message_factory(subject, advertisement_html, from_name, from_email)
+    message_bytes = factory.render(to_email, to_name, html_content)
+    
+    def connect():
+        server = smtplib.SMTP(smtp_server, smtp_port, timeout=30)
+        try:
             server.starttls()
             server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        
-        return True
-        
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    # Connecting and logging in are safe to retry
+    try:
+        server = resilient_call('smtp', connect)
+    except smtplib.SMTPAuthenticationError as e:
+        raise PermanentSendError(f"SMTP login rejected: {e.smtp_code} {e.smtp_error!r}")
+    except smtplib.SMTPResponseException as e:
+        if e.smtp_code >= 500:
+            raise PermanentSendError(f"SMTP server refused the session: {e.smtp_code} {e.smtp_error!r}")
+        raise
+    
+    try:
+        resilient_call('smtp', server.sendmail, from_email, [to_email], message_bytes, idempotent=False)
+    except smtplib.SMTPRecipientsRefused as e:
+        if all(code >= 500 for code, _ in e.recipients.values()):
+            raise PermanentSendError(f"Recipient refused: {e.recipients}")
+        raise
+    except smtplib.SMTPResponseException as e:
+        # An error reply means the relay did not accept the message; 5xx won't change on resend
+        if e.smtp_code >= 500:
+            raise PermanentSendError(f"Message rejected: {e.smtp_code} {e.smtp_error!r}")
+        raise
+    except DependencyUnavailable:
+        raise
     except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+        # A disconnect or timeout without a reply: the relay may already have accepted the
+        # message, so it is never resent automatically (delivery is at most once from here)
+        raise UncertainDeliveryError(f"{type(e).__name__}: {e}")
+    finally:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
 
 # Cloud Function entry point
 def subscriber_pipeline(request):
@@ -312,14 +577,15 @@ def subscriber_pipeline(request):
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
         }
         return ('', 204, headers)
     
     headers = {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag',
     }
     
     # Route the request based on path
@@ -327,7 +593,12 @@ def subscriber_pipeline(request):
     method = request.method
     
     try:
-        if path == '/subscribe' and method == 'POST':
+        # Tracking hits are the hottest paths, so they are matched first
+        if path == '/t/open' and method == 'GET':
+            return handle_track_open(request, headers)
+        elif path == '/t/click' and method == 'GET':
+            return handle_track_click(request, headers)
+        elif path == '/subscribe' and method == 'POST':
             return handle_subscribe(request, headers)
         elif path == '/send-template-email' and method == 'POST':
             return handle_send_template_email(request, headers)
@@ -335,14 +606,44 @@ def subscriber_pipeline(request):
             return handle_get_subscribers(request, headers)
         elif path == '/unsubscribe' and method == 'POST':
             return handle_unsubscribe(request, headers)
+        elif path == '/analytics/rollups' and method == 'GET':
+            return handle_get_rollups(request, headers)
+        elif path == '/analytics/campaigns' and method == 'GET':
+            return handle_campaign_stats(request, headers)
+        elif path == '/analytics/campaign-events' and method == 'GET':
+            return handle_campaign_events(request, headers)
+        elif path == '/validate-emails' and method == 'POST':
+            return handle_validate_emails(request, headers)
+        elif path == '/email-queue' and method == 'GET':
+            return handle_email_queue_status(request, headers)
         elif path == '/health' and method == 'GET':
             return handle_health(request, headers)
         else:
             return (jsonify({'error': 'Endpoint not found'}), 404, headers)
     
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
     except Exception as e:
         return (jsonify({'error': str(e)}), 500, headers)
 
+def dependency_unavailable_response(e, headers):
+    """Shed load with 503 while a dependency is rate limited or its circuit is open"""
+    retry_headers = dict(headers)
+    retry_headers['Retry-After'] = str(max(1, int(e.retry_after or 1)))
+    return (jsonify({'error': f'Service temporarily unavailable: {str(e)}'}), 503, retry_headers)
+
+# Proxies in front of the app that append to X-Forwarded-For (1 on Cloud Run, 2 behind an
+# external HTTPS load balancer). Entries left of those were supplied by the client and are ignored.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1'))
+
+def get_client_ip(request):
+    """Client IP as recorded by the nearest trusted proxy; client-supplied X-Forwarded-For entries are ignored"""
+    ip_address = request.remote_addr
+    forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    if TRUSTED_PROXY_HOPS > 0 and forwarded:
+        ip_address = forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    return ip_address or ''
+
 def handle_subscribe(request, headers):
     """Handle subscriber registration"""
     data = request.get_json()
@@ -352,9 +653,19 @@ def handle_subscribe(request, headers):
     if not email:
         return (jsonify({'error': 'Email is required'}), 400, headers)
     
-    ip_address = request.remote_addr
-    if request.headers.get('X-Forwarded-For'):
-        ip_address = request.headers.get('X-Forwarded-For').split(',')[0]
+    ip_address = get_client_ip(request)
+    
+    # Shed floods before any ip-api, Sheets or SMTP call is made
+    allowed, retry_after, reason = check_subscribe_limits(ip_address, email)
+    if not allowed:
+        retry_headers = dict(headers)
+        retry_headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+        return (jsonify({'error': reason}), 429, retry_headers)
+    
+    # Reject typos, disposable and dead domains before they cost a row and an SMTP session
+    valid, invalid_reason = _import('email_validation').validate_email_address(email)
+    if not valid:
+        return (jsonify({'error': 'Invalid email address', 'reason': invalid_reason}), 400, headers)
     
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     location_data = get_ip_location(ip_address)
@@ -363,48 +674,27 @@ def handle_subscribe(request, headers):
     if not client:
         return (jsonify({'error': 'Failed to connect to Google Sheets'}), 500, headers)
     
-    # Debug: List all available spreadsheets
-    try:
-        SHEET_ID = "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c"
-        print(f"🔍 Opening spreadsheet by ID: {SHEET_ID}")
-        spreadsheet = client.open_by_key(SHEET_ID)
-        sheet = spreadsheet.sheet1
-        print(f"✅ Successfully opened spreadsheet: {spreadsheet.title}")
-    except Exception as e:
-        print(f"❌ Error accessing Google Sheet by ID: {type(e).__name__}: {str(e)}")
-    
-    spreadsheet_name = os.getenv('GOOGLE_SHEET_NAME', 'Subscriber List')
-    print(f"🔍 Trying to open spreadsheet: {spreadsheet_name}")
+    # Look the email up on the shard that owns it
+    normalized_email = email.strip().lower()
     try:
-        spreadsheet = client.open_by_key(SHEET_ID)
-        print(f"✅ Successfully opened spreadsheet: {spreadsheet.title}")
-        sheet = spreadsheet.sheet1
-        print(f"✅ Successfully accessed sheet1: {sheet.title}")
+        sheet, existing_row_index, existing_row = get_shard_router(client, SHEET_ID).find_row(normalized_email)
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
     except Exception as e:
         print(f"❌ Error accessing Google Sheet: {type(e).__name__}: {str(e)}")
         return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
     
     # Check for duplicate email
-    normalized_email = email.strip().lower()
-    email_column_index = 2
-    all_emails = sheet.col_values(email_column_index)
-    
-    if normalized_email in [e.lower() for e in all_emails]:
-        existing_record = None
-        for row_idx, row_data in enumerate(sheet.get_all_records(), start=2):
-            if row_data.get('Email', '').lower() == normalized_email:
-                existing_record = row_data
-                break
-        
-        if existing_record:
-            return (jsonify({
-                'message': 'already subscribed',
-                'data': {
-                    'name': existing_record.get('Name'),
-                    'email': existing_record.get('Email'),
-                    'timestamp': existing_record.get('Timestamp')
-                }
-            }), 200, headers)
+    if existing_row_index != -1:
+        existing_row = existing_row + [''] * (3 - len(existing_row))
+        return (jsonify({
+            'message': 'already subscribed',
+            'data': {
+                'name': existing_row[0],
+                'email': existing_row[1],
+                'timestamp': existing_row[2]
+            }
+        }), 200, headers)
     
     # Add subscriber
     row_data = [
@@ -419,15 +709,21 @@ def handle_subscribe(request, headers):
         location_data.get('lon', 0)
     ]
     
-    sheet.append_row(row_data)
+    resilient_call('sheets', sheet.append_row, row_data, idempotent=False)
+    
+    # Keep analytics rollups in step with the sheet
+    try:
+        get_rollup_store().record_subscribe(row_data)
+    except Exception as e:
+        print(f"⚠️ Error updating rollups: {e}")
     
     # Send welcome email using subscribed.html template from Google Drive
     try:
         welcome_email_sent = send_welcome_email(email, name or "Anonymous")
         if welcome_email_sent:
-            print(f"✅ Welcome email sent to {email}")
+            print(f"✅ Welcome email queued for {email}")
         else:
-            print(f"⚠️ Failed to send welcome email to {email}")
+            print(f"⚠️ Failed to queue welcome email for {email}")
     except Exception as e:
         print(f"⚠️ Error sending welcome email: {e}")
     
@@ -449,17 +745,25 @@ def handle_get_subscribers(request, headers):
     client = init_google_sheets()
     if not client:
         return (jsonify({'error': 'Failed to connect to Google Sheets'}), 500, headers)
-
-    SHEET_ID = "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c"
-    spreadsheet_name = os.getenv('GOOGLE_SHEET_NAME', 'Subscriber List')
+    
+    router = get_shard_router(client, SHEET_ID)
+    
+    # The spreadsheets' Drive versions are a cheap revision tag: unchanged data means 304 or a cached body
     try:
-        spreadsheet = client.open_by_key(SHEET_ID)
-        sheet = spreadsheet.sheet1
+        version = router.revision(get_drive_service(client))
     except Exception as e:
-        return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
+        print(f"⚠️ Error reading subscriber data revision: {e}")
+        version = None
     
-    subscribers = sheet.get_all_records()
-    return (jsonify({'subscribers': subscribers}), 200, headers)
+    try:
+        return conditional_json_response(
+            request, headers, 'subscribers', version,
+            lambda: {'subscribers': router.get_all_records()}
+        )
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
+    except Exception as e:
+        return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
 
 def handle_unsubscribe(request, headers):
     """Handle unsubscribing users"""
@@ -475,29 +779,20 @@ def handle_unsubscribe(request, headers):
     if not client:
         return (jsonify({'error': 'Failed to connect to Google Sheets'}), 500, headers)
 
-    SHEET_ID = "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c"
-    
-    spreadsheet_name = os.getenv('GOOGLE_SHEET_NAME', 'Subscriber List')
+    # Only the shard that owns this email needs to be searched
     try:
-        spreadsheet = client.open_by_key(SHEET_ID)
-        sheet = spreadsheet.sheet1
+        sheet, row_to_delete_index, deleted_row_data = get_shard_router(client, SHEET_ID).find_row(normalized_email_to_delete)
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
     except Exception as e:
         return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
     
-    email_column_index = 2
-    all_emails = sheet.col_values(email_column_index)
-    
-    row_to_delete_index = -1
-    deleted_row_data = {}
-    
-    for i, email_in_sheet in enumerate(all_emails):
-        if email_in_sheet.strip().lower() == normalized_email_to_delete:
-            row_to_delete_index = i + 1
-            deleted_row_data = sheet.row_values(row_to_delete_index)
-            break
-    
     if row_to_delete_index != -1:
-        sheet.delete_rows(row_to_delete_index)
+        resilient_call('sheets', sheet.delete_rows, row_to_delete_index, idempotent=False)
+        try:
+            get_rollup_store().record_unsubscribe(deleted_row_data)
+        except Exception as e:
+            print(f"⚠️ Error updating rollups: {e}")
         return (jsonify({
             'message': 'unsubscribed successfully',
             'data': {
@@ -508,11 +803,76 @@ def handle_unsubscribe(request, headers):
     else:
         return (jsonify({'message': 'email not found'}), 404, headers)
 
+_rollup_reseed_lock = threading.Lock()
+
+def reseed_rollups(store, headers):
+    """Rebuild the rollup store from the sheet; returns an error response on failure"""
+    client = init_google_sheets()
+    if not client:
+        return (jsonify({'error': 'Failed to connect to Google Sheets'}), 500, headers)
+    try:
+        records = get_shard_router(client, SHEET_ID).get_all_records()
+    except DependencyUnavailable as e:
+        return dependency_unavailable_response(e, headers)
+    except Exception as e:
+        return (jsonify({'error': f'Error accessing Google Sheet: {str(e)}'}), 500, headers)
+    store.rebuild(record_to_row(record) for record in records)
+    return None
+
+def handle_get_rollups(request, headers):
+    """Handle reading precomputed signup rollups for the analytics dashboard"""
+    store = get_rollup_store()
+    rebuild = request.args.get('rebuild', '').lower() == 'true'
+    
+    # Seed from the sheet on first use and again once the seed is older than
+    # ROLLUP_RESEED_SECONDS, so per-instance counts can't drift apart indefinitely.
+    # Between reseeds subscribe/unsubscribe keep the store current.
+    seeded = store.is_seeded()
+    if rebuild or not seeded or store.is_stale():
+        # Only one thread reseeds; once seeded, others keep serving the current counters
+        if _rollup_reseed_lock.acquire(blocking=not seeded or rebuild):
+            try:
+                if rebuild or not store.is_seeded() or store.is_stale():
+                    response = reseed_rollups(store, headers)
+                    if response is not None:
+                        return response
+            finally:
+                _rollup_reseed_lock.release()
+    
+    def build_payload():
+        group_by = request.args.get('group_by', 'country').split(',')
+        rollups = store.query(
+            group_by=[col.strip() for col in group_by if col.strip()],
+            start_date=request.args.get('start_date'),
+            end_date=request.args.get('end_date'),
+            country=request.args.get('country'),
+            region=request.args.get('region'),
+            city=request.args.get('city'),
+        )
+        return {
+            'rollups': rollups,
+            'heatmap': store.heatmap(),
+            'grid_degrees': store.grid_degrees
+        }
+    
+    # Each query shape is its own representation of the same store revision
+    version = f"{store.revision()}?{request.query_string.decode('utf-8')}"
+    return conditional_json_response(request, headers, 'analytics-rollups', version, build_payload)
+
 def handle_health(request, headers):
     """Health check endpoint"""
-    return (jsonify({'status': 'healthy', 'message': 'Subscriber Pipeline is running'}), 200, headers)
+    return (jsonify({
+        'status': 'healthy',
+        'message': 'Subscriber Pipeline is running',
+        'import_timings_ms': IMPORT_TIMINGS,
+        'dependencies': dependency_status()
+    }), 200, headers)
 
 # Add routes for local Flask development
+@app.errorhandler(DependencyUnavailable)
+def dependency_unavailable_local(e):
+    return dependency_unavailable_response(e, {})
+
 @app.route('/health', methods=['GET'])
 def health_local():
     return handle_health(None, {})
@@ -533,6 +893,44 @@ def subscribers_local():
 def unsubscribe_local():
     return handle_unsubscribe(request, {})
 
+@app.route('/analytics/rollups', methods=['GET'])
+def rollups_local():
+    return handle_get_rollups(request, {})
+
+@app.route('/email-queue', methods=['GET'])
+def email_queue_local():
+    return handle_email_queue_status(request, {})
+
+@app.route('/validate-emails', methods=['POST'])
+def validate_emails_local():
+    return handle_validate_emails(request, {})
+
+@app.route('/t/open', methods=['GET'])
+def track_open_local():
+    return handle_track_open(request, {})
+
+@app.route('/t/click', methods=['GET'])
+def track_click_local():
+    return handle_track_click(request, {})
+
+@app.route('/analytics/campaigns', methods=['GET'])
+def campaign_stats_local():
+    return handle_campaign_stats(request, {})
+
+@app.route('/analytics/campaign-events', methods=['GET'])
+def campaign_events_local():
+    return handle_campaign_events(request, {})
+
+IMPORT_TIMINGS['main'] = round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 2)
+
+# Warm credentials and the Drive client in the background so the first request after idle doesn't pay for them
+if os.getenv('PREWARM_ON_STARTUP', 'true').lower() == 'true' and os.getenv('GOOGLE_CREDENTIALS'):
+    threading.Thread(target=prewarm_clients, daemon=True).start()
+
+# Resume delivery of queued and scheduled mail left over from a previous process
+if os.path.exists(EMAIL_QUEUE_DB_PATH):
+    outbound_email_queue()
+
 # Only for local testing
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8000)
@@ -0,0 +1,109 @@
+import binascii
+import threading
+from collections import OrderedDict
+from email.header import Header
+from email.utils import formataddr, make_msgid
+
+# Pre-serialized campaign messages. Everything that is identical across recipients
+# (headers, HTML wrapper, advertisement block, encoded subject, MIME boundaries) is
+# rendered to bytes once; each send only splices in the To header and the
+# base64-encoded personalized body, and the result goes straight to sendmail().
+
+CRLF = b'\r\n'
+
+
+def _clean_header_value(value):
+    # Header values come from user input; never let them start a new header line
+    return (value or '').replace('\r', ' ').replace('\n', ' ')
+
+
+def _encode_address(name, email):
+    return formataddr((_clean_header_value(name), _clean_header_value(email)), charset='utf-8')
+
+
+def wrap_html(subject, html_content, advertisement_html):
+    """The HTML wrapper every outgoing email is sent in"""
+    return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <title>{subject}</title>
+        </head>
+        <body style="font-family: Arial, sans-serif; line-height: 1; color: #333; margin: 0 auto; padding: 2px;">
+            {html_content}
+            <hr style="margin: 30px 0; border: none; border-top: 1px solid #eee;">
+            {advertisement_html}
+        </body>
+        </html>
+        """
+
+
+class CampaignMessageFactory:
+    """Render per-recipient RFC 5322 message bytes from a pre-serialized skeleton"""
+
+    def __init__(self, subject, advertisement_html, from_name, from_email):
+        self.from_email = from_email
+        boundary = '===============' + make_msgid(domain='campaign').strip('<>').replace('@', '.') + '=='
+
+        # Split the wrapper around the personalized body once
+        marker = '\x00BODY\x00'
+        wrapper = wrap_html(subject, marker, advertisement_html)
+        prefix, suffix = wrapper.split(marker)
+        self._body_prefix = prefix.encode('utf-8')
+        self._body_suffix = suffix.encode('utf-8')
+
+        self._headers = CRLF.join([
+            f'Content-Type: multipart/alternative; boundary="{boundary}"'.encode('ascii'),
+            b'MIME-Version: 1.0',
+            b'Subject: ' + Header(subject, 'utf-8').encode(linesep='\r\n').encode('ascii'),
+            b'From: ' + _encode_address(from_name, from_email).encode('ascii'),
+        ]) + CRLF
+        self._part_open = CRLF.join([
+            b'',
+            f'--{boundary}'.encode('ascii'),
+            b'Content-Type: text/html; charset="utf-8"',
+            b'MIME-Version: 1.0',
+            b'Content-Transfer-Encoding: base64',
+            b'',
+            b'',
+        ])
+        self._part_close = CRLF + f'--{boundary}--'.encode('ascii') + CRLF
+
+    def render(self, to_email, to_name, html_content):
+        """Return the full message bytes for one recipient"""
+        body = self._body_prefix + html_content.encode('utf-8') + self._body_suffix
+        # 57 input bytes per 76-character base64 line, as the email package does
+        encoded = b''.join(
+            binascii.b2a_base64(body[i:i + 57], newline=False) + CRLF
+            for i in range(0, len(body), 57)
+        )
+        return b''.join([
+            self._headers,
+            b'To: ', _encode_address(to_name, to_email).encode('ascii'), CRLF,
+            self._part_open,
+            encoded,
+            self._part_close,
+        ])
+
+
+_factories = OrderedDict()
+_factories_lock = threading.Lock()
+_MAX_FACTORIES = 32
+
+
+def get_message_factory(subject, advertisement_html, from_name, from_email):
+    """Return a cached factory so every recipient of a campaign reuses one skeleton"""
+    key = (subject, advertisement_html, from_name, from_email)
+    with _factories_lock:
+        factory = _factories.get(key)
+        if factory is not None:
+            _factories.move_to_end(key)
+            return factory
+    factory = CampaignMessageFactory(subject, advertisement_html, from_name, from_email)
+    with _factories_lock:
+        _factories[key] = factory
+        while len(_factories) > _MAX_FACTORIES:
+            _factories.popitem(last=False)
+    return factory
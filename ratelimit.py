@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+import zlib
+from collections import OrderedDict
+
+# In-process rate limiting for /subscribe. Each key (client IP, email domain) gets
+# a token bucket stored as a two-item list in an LRU map. Keys are spread over
+# independently locked shards so concurrent requests rarely contend, and every
+# shard is capped so a flood of distinct keys cannot grow memory without bound.
+
+SUBSCRIBE_IP_RATE_PER_MINUTE = float(os.getenv('SUBSCRIBE_IP_RATE_PER_MINUTE', '5'))
+SUBSCRIBE_IP_BURST = float(os.getenv('SUBSCRIBE_IP_BURST', '5'))
+SUBSCRIBE_DOMAIN_RATE_PER_MINUTE = float(os.getenv('SUBSCRIBE_DOMAIN_RATE_PER_MINUTE', '120'))
+SUBSCRIBE_DOMAIN_BURST = float(os.getenv('SUBSCRIBE_DOMAIN_BURST', '30'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '65536'))
+# Large consumer mail providers are exempt from the per-domain limit: a single bot
+# could otherwise drain the shared bucket and block every legitimate gmail.com signup
+SUBSCRIBE_DOMAIN_EXEMPT = frozenset(
+    domain.strip().lower()
+    for domain in os.getenv(
+        'SUBSCRIBE_DOMAIN_EXEMPT',
+        'gmail.com,googlemail.com,outlook.com,hotmail.com,live.com,msn.com,yahoo.com,'
+        'icloud.com,me.com,aol.com,proton.me,protonmail.com,gmx.com,gmx.de,mail.ru,yandex.ru,qq.com,163.com'
+    ).split(',')
+    if domain.strip()
+)
+
+
+class ShardedRateLimiter:
+    """Per-key token buckets in lock-sharded, size-bounded LRU maps"""
+
+    def __init__(self, rate_per_minute, burst, shards=16, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._max_keys_per_shard = max(1, max_keys // shards)
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[zlib.crc32(key.encode('utf-8')) % len(self._shards)]
+
+    def check(self, key):
+        """Take a token for key; returns (allowed, retry_after_seconds)"""
+        lock, buckets = self._shard(key)
+        now = time.monotonic()
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [self.burst, now]
+                if len(buckets) > self._max_keys_per_shard:
+                    buckets.popitem(last=False)
+            else:
+                buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0.0
+            return False, (1 - bucket[0]) / self.rate if self.rate else 60.0
+
+
+ip_limiter = ShardedRateLimiter(SUBSCRIBE_IP_RATE_PER_MINUTE, SUBSCRIBE_IP_BURST)
+domain_limiter = ShardedRateLimiter(SUBSCRIBE_DOMAIN_RATE_PER_MINUTE, SUBSCRIBE_DOMAIN_BURST)
+
+
+def check_subscribe_limits(ip_address, email):
+    """Return (allowed, retry_after_seconds, reason) for a signup attempt"""
+    allowed, retry_after = ip_limiter.check((ip_address or '').strip())
+    if not allowed:
+        return False, retry_after, 'Too many signups from this IP address'
+
+    # Only requests that passed the per-IP check reach the shared domain bucket
+    domain = email.rsplit('@', 1)[-1].strip().lower() if '@' in email else ''
+    if domain in SUBSCRIBE_DOMAIN_EXEMPT:
+        return True, 0.0, None
+    allowed, retry_after = domain_limiter.check(domain)
+    if not allowed:
+        return False, retry_after, 'Too many signups for this email domain'
+
+    return True, 0.0, None
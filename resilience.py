@@ -0,0 +1,235 @@
+import os
+import time
+import random
+import threading
+
+# Shared resilience layer for remote dependencies (Google Sheets, Google Drive,
+# ip-api and SMTP): exponential backoff with full jitter that honors
+# Retry-After, a token bucket sized to each dependency's quota, and a
+# circuit breaker that sheds load while a dependency is down.
+
+RETRYABLE_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class DependencyUnavailable(Exception):
+    """Raised when a dependency cannot be called right now"""
+
+    def __init__(self, dependency, message, retry_after=None):
+        super().__init__(message)
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """Raised when a dependency's circuit breaker is open"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to `timeout` seconds; returns False if none became available"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures, half-open after `reset_timeout` to probe recovery"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, f"{self.name} circuit is open", retry_after=remaining)
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.name, f"{self.name} circuit is half-open", retry_after=1.0)
+                self._probe_in_flight = True
+
+    def release_probe(self):
+        """Give up a half-open probe slot without recording an outcome"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"⚠️ Circuit for {self.name} opened after {self._failures} failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+def _parse_retry_after(value):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_of(exc):
+    status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'resp', None), 'status', None)
+    return int(status) if status is not None else None
+
+
+def classify_error(exc):
+    """Return (retryable, retry_after_seconds) for an exception raised by a dependency call"""
+    # gspread APIError / requests HTTPError carry a requests.Response
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is not None:
+        retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+        return status in RETRYABLE_HTTP_STATUSES, retry_after
+
+    # googleapiclient HttpError carries an httplib2 response
+    resp = getattr(exc, 'resp', None)
+    status = getattr(resp, 'status', None)
+    if status is not None:
+        retry_after = _parse_retry_after(resp.get('retry-after'))
+        return int(status) in RETRYABLE_HTTP_STATUSES, retry_after
+
+    # smtplib response errors: 4xx are transient, 5xx are permanent
+    smtp_code = getattr(exc, 'smtp_code', None)
+    if smtp_code is not None:
+        return 400 <= smtp_code < 500, None
+
+    # Every recipient rejected is a permanent problem with the message, not the relay
+    if type(exc).__name__ == 'SMTPRecipientsRefused':
+        return False, None
+
+    # Connection resets, timeouts and disconnects (requests, socket and smtplib errors are OSErrors)
+    if isinstance(exc, OSError):
+        return True, None
+    return False, None
+
+
+class DependencyPolicy:
+    """Retry, rate limit and circuit breaker settings for one dependency"""
+
+    def __init__(self, name, rate_per_minute=None, burst=None, max_attempts=4,
+                 base_delay=0.5, max_delay=32.0, acquire_timeout=10.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.bucket = None
+        if rate_per_minute:
+            self.bucket = TokenBucket(rate_per_minute / 60.0, burst or max(1, rate_per_minute // 6))
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+# Default budgets follow the quota that binds first. Every Sheets call runs as the
+# one service account, so the per-user limit of 60 req/min applies, not the
+# 300 req/min per-project one. Drive allows 12,000 req/min per user, and the
+# ip-api free tier allows 45 req/min.
+DEPENDENCIES = {
+    'sheets': DependencyPolicy('sheets', rate_per_minute=_env_int('SHEETS_RATE_PER_MINUTE', 60)),
+    'drive': DependencyPolicy('drive', rate_per_minute=_env_int('DRIVE_RATE_PER_MINUTE', 12000)),
+    'ip-api': DependencyPolicy('ip-api', rate_per_minute=_env_int('IP_API_RATE_PER_MINUTE', 45),
+                               max_attempts=2, acquire_timeout=0.5),
+    'smtp': DependencyPolicy('smtp', max_attempts=3, base_delay=1.0),
+}
+
+
+def resilient_call(dependency, fn, *args, idempotent=True, **kwargs):
+    """Call fn(*args, **kwargs) under the named dependency's rate limit, retry and circuit breaker.
+
+    Non-idempotent calls (e.g. appending a row) are only retried on 429, where the
+    request is known to have been rejected before taking effect.
+    """
+    policy = DEPENDENCIES[dependency]
+    attempt = 0
+    while True:
+        policy.breaker.before_call()
+        if policy.bucket and not policy.bucket.acquire(timeout=policy.acquire_timeout):
+            # Not a dependency failure: release a half-open probe without tripping the breaker
+            policy.breaker.release_probe()
+            raise DependencyUnavailable(dependency, f"{dependency} rate limit exceeded", retry_after=1.0)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            retryable, retry_after = classify_error(e)
+            if not retryable:
+                # Permanent errors (bad request, not found, auth) say nothing about availability
+                policy.breaker.record_success()
+                raise
+            policy.breaker.record_failure()
+            attempt += 1
+            if not idempotent and _status_of(e) != 429:
+                raise
+            if attempt >= policy.max_attempts or policy.breaker.state == CircuitBreaker.OPEN:
+                raise
+            delay = policy.backoff(attempt, retry_after)
+            print(f"⚠️ {dependency} call failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        policy.breaker.record_success()
+        return result
+
+
+def dependency_status():
+    """Return the current circuit state of every dependency"""
+    return {name: policy.breaker.state for name, policy in DEPENDENCIES.items()}
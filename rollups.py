@@ -0,0 +1,210 @@
+import os
+import math
+import sqlite3
+import threading
+from datetime import datetime
+
+# Incrementally maintained signup rollups for the analytics dashboard.
+# Counters are keyed by (day, country, region, city) plus a lat/lon grid
+# histogram, so dashboard reads never need a full get_all_records() pull.
+
+ROLLUPS_DB_PATH = os.getenv('ROLLUPS_DB_PATH', '/tmp/subscriber_rollups.db')
+ROLLUP_GRID_DEGREES = float(os.getenv('ROLLUP_GRID_DEGREES', '1.0'))
+# Each instance only sees the signups it served itself, so its counters drift from
+# other instances'; reseeding from the sheet after this many seconds bounds the drift
+ROLLUP_RESEED_SECONDS = int(os.getenv('ROLLUP_RESEED_SECONDS', '900'))
+
+GROUP_BY_COLUMNS = ('day', 'country', 'region', 'city')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _row_key(row):
+    """Extract (day, country, region, city, lat, lon) from a sheet row list"""
+    row = list(row) + [''] * (9 - len(row))
+    timestamp = str(row[2] or '')
+    day = timestamp[:10] if timestamp else datetime.now().strftime('%Y-%m-%d')
+    country = str(row[4] or '').strip().lower()
+    region = str(row[5] or '').strip().lower()
+    city = str(row[6] or '').strip().lower()
+    return day, country, region, city, _to_float(row[7]), _to_float(row[8])
+
+
+def record_to_row(record):
+    """Convert a get_all_records() dict into the sheet row order"""
+    return [
+        record.get('Name', ''),
+        record.get('Email', ''),
+        record.get('Timestamp', ''),
+        record.get('IP Address', ''),
+        record.get('Country', ''),
+        record.get('Region', ''),
+        record.get('City', ''),
+        record.get('Latitude', ''),
+        record.get('Longitude', ''),
+    ]
+
+
+class RollupStore:
+    """SQLite-backed counters updated on every subscribe and unsubscribe"""
+
+    def __init__(self, path=ROLLUPS_DB_PATH, grid_degrees=ROLLUP_GRID_DEGREES):
+        self.path = path
+        self.grid_degrees = grid_degrees
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signup_counts (
+                day TEXT NOT NULL,
+                country TEXT NOT NULL,
+                region TEXT NOT NULL,
+                city TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, country, region, city)
+            );
+            CREATE TABLE IF NOT EXISTS geo_grid (
+                lat_cell INTEGER NOT NULL,
+                lon_cell INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (lat_cell, lon_cell)
+            );
+            CREATE TABLE IF NOT EXISTS rollup_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._conn.commit()
+
+    def _cell(self, lat, lon):
+        if lat is None or lon is None or (lat == 0 and lon == 0):
+            return None
+        return (math.floor(lat / self.grid_degrees), math.floor(lon / self.grid_degrees))
+
+    def _apply(self, row, delta):
+        day, country, region, city, lat, lon = _row_key(row)
+        self._conn.execute(
+            "INSERT INTO signup_counts (day, country, region, city, count) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(day, country, region, city) DO UPDATE SET count = MAX(count + ?, 0)",
+            (day, country, region, city, max(delta, 0), delta),
+        )
+        cell = self._cell(lat, lon)
+        if cell:
+            self._conn.execute(
+                "INSERT INTO geo_grid (lat_cell, lon_cell, count) VALUES (?, ?, ?) "
+                "ON CONFLICT(lat_cell, lon_cell) DO UPDATE SET count = MAX(count + ?, 0)",
+                (cell[0], cell[1], max(delta, 0), delta),
+            )
+
+    def _bump_revision(self):
+        self._conn.execute(
+            "INSERT INTO rollup_meta (key, value) VALUES ('revision', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def record_subscribe(self, row):
+        with self._lock:
+            self._apply(row, 1)
+            self._bump_revision()
+            self._conn.commit()
+
+    def record_unsubscribe(self, row):
+        with self._lock:
+            self._apply(row, -1)
+            self._bump_revision()
+            self._conn.commit()
+
+    def revision(self):
+        """Cheap version tag that changes whenever any counter changes"""
+        with self._lock:
+            meta = dict(self._conn.execute(
+                "SELECT key, value FROM rollup_meta WHERE key IN ('seeded_at', 'revision')"
+            ).fetchall())
+        return f"{meta.get('seeded_at', '')}:{meta.get('revision', '0')}"
+
+    def is_seeded(self):
+        with self._lock:
+            cur = self._conn.execute("SELECT value FROM rollup_meta WHERE key = 'seeded_at'")
+            return cur.fetchone() is not None
+
+    def is_stale(self, max_age_seconds=ROLLUP_RESEED_SECONDS):
+        """True when the store was seeded longer ago than max_age_seconds (0 disables reseeding)"""
+        if max_age_seconds <= 0:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM rollup_meta WHERE key = 'seeded_at'").fetchone()
+        if row is None:
+            return True
+        seeded_at = datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S')
+        return (datetime.now() - seeded_at).total_seconds() > max_age_seconds
+
+    def rebuild(self, rows):
+        """Replace all counters with a fresh aggregation of the given rows"""
+        with self._lock:
+            self._conn.execute("DELETE FROM signup_counts")
+            self._conn.execute("DELETE FROM geo_grid")
+            for row in rows:
+                self._apply(row, 1)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('seeded_at', ?)",
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),),
+            )
+            self._bump_revision()
+            self._conn.commit()
+
+    def query(self, group_by=('country',), start_date=None, end_date=None,
+              country=None, region=None, city=None):
+        """Return summed counts grouped by any subset of day/country/region/city"""
+        group_by = [col for col in group_by if col in GROUP_BY_COLUMNS]
+        where, params = ["count > 0"], []
+        if start_date:
+            where.append("day >= ?")
+            params.append(start_date)
+        if end_date:
+            where.append("day <= ?")
+            params.append(end_date)
+        for col, value in (('country', country), ('region', region), ('city', city)):
+            if value:
+                where.append(f"{col} = ?")
+                params.append(value.strip().lower())
+
+        select_cols = ', '.join(group_by)
+        sql = f"SELECT {select_cols + ', ' if group_by else ''}SUM(count) FROM signup_counts WHERE {' AND '.join(where)}"
+        if group_by:
+            sql += f" GROUP BY {select_cols} ORDER BY {select_cols}"
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        if not group_by:
+            return [{'count': rows[0][0] or 0}]
+        return [dict(zip(group_by + ['count'], r)) for r in rows]
+
+    def heatmap(self):
+        """Return the lat/lon grid histogram as cell-center points"""
+        size = self.grid_degrees
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lat_cell, lon_cell, count FROM geo_grid WHERE count > 0"
+            ).fetchall()
+        return [
+            {'lat': (lat_cell + 0.5) * size, 'lon': (lon_cell + 0.5) * size, 'count': count}
+            for lat_cell, lon_cell, count in rows
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rollup_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RollupStore()
+    return _store
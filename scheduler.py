@@ -0,0 +1,268 @@
+import os
+import math
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+# Time-zone-aware campaign scheduling. Recipients are bucketed into delivery waves
+# by the UTC instant their send time falls on, and every message in a wave gets a
+# staggered not-before time so the campaign is released at a controlled rate. The
+# schedule lives in the outbound queue's SQLite file, so it only survives restarts
+# when EMAIL_QUEUE_DB_PATH is on persistent storage.
+
+CAMPAIGN_RELEASE_PER_MINUTE = float(os.getenv('CAMPAIGN_RELEASE_PER_MINUTE', '300'))
+CAMPAIGN_WAVE_MINUTES = int(os.getenv('CAMPAIGN_WAVE_MINUTES', '15'))
+CAMPAIGN_DEFAULT_TIMEZONE = os.getenv('CAMPAIGN_DEFAULT_TIMEZONE', 'UTC')
+
+
+class ScheduleError(ValueError):
+    """Raised when a send_at / local_send_time value is malformed"""
+
+
+# Countries that observe a single time zone (stored lowercase, as ip-api names them).
+# Countries spanning several zones are resolved by region (REGION_TIMEZONES) and
+# otherwise fall back to the subscriber's longitude.
+COUNTRY_TIMEZONES = {
+    'argentina': 'America/Argentina/Buenos_Aires', 'austria': 'Europe/Vienna',
+    'bangladesh': 'Asia/Dhaka', 'belgium': 'Europe/Brussels', 'chile': 'America/Santiago',
+    'china': 'Asia/Shanghai', 'colombia': 'America/Bogota', 'czechia': 'Europe/Prague',
+    'denmark': 'Europe/Copenhagen', 'egypt': 'Africa/Cairo', 'finland': 'Europe/Helsinki',
+    'france': 'Europe/Paris', 'germany': 'Europe/Berlin', 'greece': 'Europe/Athens',
+    'hong kong': 'Asia/Hong_Kong', 'hungary': 'Europe/Budapest', 'india': 'Asia/Kolkata',
+    'ireland': 'Europe/Dublin', 'israel': 'Asia/Jerusalem', 'italy': 'Europe/Rome',
+    'japan': 'Asia/Tokyo', 'kenya': 'Africa/Nairobi', 'malaysia': 'Asia/Kuala_Lumpur',
+    'netherlands': 'Europe/Amsterdam', 'new zealand': 'Pacific/Auckland', 'nigeria': 'Africa/Lagos',
+    'norway': 'Europe/Oslo', 'pakistan': 'Asia/Karachi', 'peru': 'America/Lima',
+    'philippines': 'Asia/Manila', 'poland': 'Europe/Warsaw', 'portugal': 'Europe/Lisbon',
+    'romania': 'Europe/Bucharest', 'saudi arabia': 'Asia/Riyadh', 'singapore': 'Asia/Singapore',
+    'south africa': 'Africa/Johannesburg', 'south korea': 'Asia/Seoul', 'spain': 'Europe/Madrid',
+    'sweden': 'Europe/Stockholm', 'switzerland': 'Europe/Zurich', 'taiwan': 'Asia/Taipei',
+    'thailand': 'Asia/Bangkok', 'turkey': 'Europe/Istanbul', 'ukraine': 'Europe/Kyiv',
+    'united arab emirates': 'Asia/Dubai', 'united kingdom': 'Europe/London', 'vietnam': 'Asia/Ho_Chi_Minh',
+}
+
+
+# (country, region) -> zone for countries spanning several zones, keyed by ip-api's
+# country and regionName, lowercased with accents stripped. States split between
+# zones map to the zone most of their population observes.
+_REGION_ZONES = {
+    'united states': {
+        'America/New_York': (
+            'connecticut', 'delaware', 'district of columbia', 'florida', 'georgia', 'maine',
+            'maryland', 'massachusetts', 'new hampshire', 'new jersey', 'new york', 'north carolina',
+            'ohio', 'pennsylvania', 'rhode island', 'south carolina', 'vermont', 'virginia', 'west virginia',
+        ),
+        'America/Detroit': ('michigan',),
+        'America/Indiana/Indianapolis': ('indiana',),
+        'America/Kentucky/Louisville': ('kentucky',),
+        'America/Chicago': (
+            'alabama', 'arkansas', 'illinois', 'iowa', 'kansas', 'louisiana', 'minnesota', 'mississippi',
+            'missouri', 'nebraska', 'north dakota', 'oklahoma', 'south dakota', 'tennessee', 'texas', 'wisconsin',
+        ),
+        'America/Denver': ('colorado', 'montana', 'new mexico', 'utah', 'wyoming'),
+        'America/Boise': ('idaho',),
+        'America/Phoenix': ('arizona',),
+        'America/Los_Angeles': ('california', 'nevada', 'oregon', 'washington'),
+        'America/Anchorage': ('alaska',),
+        'Pacific/Honolulu': ('hawaii',),
+    },
+    'canada': {
+        'America/Toronto': ('ontario', 'quebec'),
+        'America/Halifax': ('nova scotia', 'prince edward island'),
+        'America/Moncton': ('new brunswick',),
+        'America/St_Johns': ('newfoundland and labrador',),
+        'America/Winnipeg': ('manitoba',),
+        'America/Regina': ('saskatchewan',),
+        'America/Edmonton': ('alberta', 'northwest territories'),
+        'America/Vancouver': ('british columbia',),
+        'America/Whitehorse': ('yukon',),
+        'America/Iqaluit': ('nunavut',),
+    },
+    'brazil': {
+        'America/Sao_Paulo': (
+            'sao paulo', 'rio de janeiro', 'minas gerais', 'espirito santo', 'parana', 'santa catarina',
+            'rio grande do sul', 'goias', 'federal district', 'distrito federal',
+        ),
+        'America/Bahia': ('bahia',),
+        'America/Recife': ('pernambuco', 'paraiba', 'rio grande do norte'),
+        'America/Maceio': ('alagoas', 'sergipe'),
+        'America/Fortaleza': ('ceara', 'piaui', 'maranhao'),
+        'America/Belem': ('para', 'amapa'),
+        'America/Araguaina': ('tocantins',),
+        'America/Cuiaba': ('mato grosso',),
+        'America/Campo_Grande': ('mato grosso do sul',),
+        'America/Manaus': ('amazonas',),
+        'America/Porto_Velho': ('rondonia',),
+        'America/Boa_Vista': ('roraima',),
+        'America/Rio_Branco': ('acre',),
+    },
+    'australia': {
+        'Australia/Sydney': ('new south wales', 'australian capital territory'),
+        'Australia/Melbourne': ('victoria',),
+        'Australia/Brisbane': ('queensland',),
+        'Australia/Adelaide': ('south australia',),
+        'Australia/Perth': ('western australia',),
+        'Australia/Hobart': ('tasmania',),
+        'Australia/Darwin': ('northern territory',),
+    },
+    'mexico': {
+        'America/Mexico_City': (
+            'mexico city', 'mexico', 'state of mexico', 'aguascalientes', 'chiapas', 'colima', 'guanajuato',
+            'guerrero', 'hidalgo', 'jalisco', 'michoacan', 'morelos', 'oaxaca', 'puebla', 'queretaro',
+            'san luis potosi', 'tabasco', 'tlaxcala', 'veracruz', 'zacatecas',
+        ),
+        'America/Monterrey': ('nuevo leon', 'coahuila', 'durango', 'tamaulipas'),
+        'America/Merida': ('yucatan', 'campeche'),
+        'America/Cancun': ('quintana roo',),
+        'America/Chihuahua': ('chihuahua',),
+        'America/Hermosillo': ('sonora',),
+        'America/Mazatlan': ('sinaloa', 'nayarit', 'baja california sur'),
+        'America/Tijuana': ('baja california',),
+    },
+    'russia': {
+        'Europe/Kaliningrad': ('kaliningrad', 'kaliningrad oblast'),
+        'Europe/Moscow': (
+            'moscow', 'moscow oblast', 'st.-petersburg', 'saint petersburg', 'leningrad oblast',
+            'krasnodar krai', 'rostov oblast', 'tatarstan republic', 'nizhny novgorod oblast', 'voronezh oblast',
+        ),
+        'Europe/Samara': ('samara oblast', 'udmurtiya republic'),
+        'Asia/Yekaterinburg': (
+            'sverdlovsk oblast', 'chelyabinsk oblast', 'chelyabinsk', 'bashkortostan republic', 'perm krai',
+            'tyumen oblast', 'orenburg oblast',
+        ),
+        'Asia/Omsk': ('omsk oblast',),
+        'Asia/Novosibirsk': ('novosibirsk oblast',),
+        'Asia/Novokuznetsk': ('kemerovo oblast',),
+        'Asia/Krasnoyarsk': ('krasnoyarsk krai',),
+        'Asia/Irkutsk': ('irkutsk oblast',),
+        'Asia/Yakutsk': ('sakha',),
+        'Asia/Vladivostok': ('primorye', 'primorsky krai', 'khabarovsk', 'khabarovsk krai'),
+        'Asia/Magadan': ('magadan oblast',),
+        'Asia/Kamchatka': ('kamchatka',),
+    },
+}
+REGION_TIMEZONES = {
+    (country, region): zone
+    for country, zones in _REGION_ZONES.items()
+    for zone, regions in zones.items()
+    for region in regions
+}
+
+
+def _location_key(value):
+    """Lowercase and strip accents so 'São Paulo' and 'Sao Paulo' match"""
+    value = unicodedata.normalize('NFKD', str(value or '').strip().lower())
+    return ''.join(c for c in value if not unicodedata.combining(c))
+
+
+def _zone(name):
+    if ZoneInfo is None:
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return timezone.utc
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def subscriber_timezone(subscriber):
+    """Best-effort tzinfo for a subscriber record from Country, then Region, then Longitude"""
+    country = _location_key(subscriber.get('Country'))
+    if country in COUNTRY_TIMEZONES:
+        return _zone(COUNTRY_TIMEZONES[country])
+    region_zone = REGION_TIMEZONES.get((country, _location_key(subscriber.get('Region'))))
+    if region_zone:
+        return _zone(region_zone)
+
+    lat = _to_float(subscriber.get('Latitude'))
+    lon = _to_float(subscriber.get('Longitude'))
+    if lon is not None and not (lat == 0 and lon == 0):
+        # Solar offset: 15 degrees of longitude per hour
+        return timezone(timedelta(hours=max(-12, min(14, round(lon / 15)))))
+
+    return _zone(CAMPAIGN_DEFAULT_TIMEZONE)
+
+
+def parse_send_at(value):
+    """Parse an ISO 8601 instant; naive values are taken as UTC"""
+    try:
+        send_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ScheduleError(f"Invalid send_at '{value}', expected ISO 8601 like 2025-01-09T14:00:00Z")
+    if send_at.tzinfo is None:
+        send_at = send_at.replace(tzinfo=timezone.utc)
+    return send_at.astimezone(timezone.utc)
+
+
+def parse_local_time(value):
+    try:
+        hour, minute = str(value).split(':')[:2]
+        hour, minute = int(hour), int(minute)
+    except ValueError:
+        raise ScheduleError(f"Invalid local_send_time '{value}', expected HH:MM")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ScheduleError(f"Invalid local_send_time '{value}', expected HH:MM")
+    return hour, minute
+
+
+def next_local_occurrence(hour, minute, tz, now):
+    """The next UTC instant at which it is hour:minute in tz"""
+    local_now = now.astimezone(tz)
+    candidate = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= local_now:
+        candidate = (candidate + timedelta(days=1)).replace(hour=hour, minute=minute)
+    return candidate.astimezone(timezone.utc)
+
+
+def _wave_start(instant):
+    wave_seconds = CAMPAIGN_WAVE_MINUTES * 60
+    return datetime.fromtimestamp(
+        math.floor(instant.timestamp() / wave_seconds) * wave_seconds, tz=timezone.utc
+    )
+
+
+def plan_waves(subscribers, send_at=None, local_send_time=None, now=None):
+    """Group subscribers into delivery waves.
+
+    Returns a list of (wave_start_utc, [subscriber, ...]) sorted by time. With
+    local_send_time every subscriber is bucketed by when that local time next
+    occurs for them; with send_at (or neither) everyone is in a single wave.
+    """
+    now = now or datetime.now(timezone.utc)
+    if local_send_time is not None:
+        hour, minute = parse_local_time(local_send_time)
+        waves = {}
+        for subscriber in subscribers:
+            instant = next_local_occurrence(hour, minute, subscriber_timezone(subscriber), now)
+            waves.setdefault(_wave_start(instant), []).append(subscriber)
+        return sorted(waves.items(), key=lambda wave: wave[0])
+
+    start = parse_send_at(send_at) if send_at is not None else now
+    return [(max(start, now), list(subscribers))]
+
+
+def release_schedule(waves, rate_per_minute=CAMPAIGN_RELEASE_PER_MINUTE):
+    """Yield (subscriber, not_before_epoch) for every wave at rate_per_minute overall.
+
+    One release cursor spans the whole campaign: a wave starts at its own time or
+    when the previous wave has finished releasing, whichever is later, so long
+    waves never overlap and multiply the release rate.
+    """
+    interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+    cursor = None
+    for wave_start, wave in waves:
+        slot = wave_start.timestamp() if cursor is None else max(wave_start.timestamp(), cursor)
+        for subscriber in wave:
+            yield subscriber, slot
+            slot += interval
+        cursor = slot
@@ -0,0 +1,70 @@
+'''
+This script moves subscribers to the shard that owns them after SUBSCRIBER_SHARDS
+changes (e.g. a new spreadsheet was added). Rows are copied to their new shard
+(skipping emails it already has, so re-running after a failure is safe) before
+being removed from the old one. Until it finishes, rows not yet moved are
+invisible to the duplicate check in /subscribe and to /unsubscribe, so run it
+right after changing SUBSCRIBER_SHARDS.
+
+Usage:
+SUBSCRIBER_SHARDS="<sheet-id-1>,<sheet-id-2>,<sheet-id-3>" python rebalance_shards.py [--dry-run]
+'''
+
+import sys
+import os
+
+# Get the absolute path to the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+from sharding import ShardRouter, parse_shards
+
+DEFAULT_SHEET_ID = "1G47eBaTt1nAjj0N5w5oO-Z6wWX7Z3Gtf-wvkmuLs33c"
+
+def rebalance_shards(dry_run=False):
+    """Move every subscriber row onto the shard its email hashes to"""
+
+    # Define the scope
+    SCOPES = [
+        'https://www.googleapis.com/auth/spreadsheets',
+        'https://www.googleapis.com/auth/drive'
+    ]
+
+    try:
+        credentials_path = os.path.join(PROJECT_ROOT, 'google-credentials.json')
+        if not os.path.exists(credentials_path):
+            print(f"❌ Credentials file not found at: {credentials_path}")
+            return
+
+        credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, SCOPES)
+        client = gspread.authorize(credentials)
+
+        shards = parse_shards(
+            os.getenv('SUBSCRIBER_SHARDS', ''),
+            os.getenv('GOOGLE_SHEET_ID', DEFAULT_SHEET_ID)
+        )
+        print(f"🔍 Rebalancing across {len(shards)} shard(s)")
+        for index, (spreadsheet_id, worksheet_title) in enumerate(shards):
+            print(f"   {index}: {spreadsheet_id}{'/' + worksheet_title if worksheet_title else ''}")
+
+        summary = ShardRouter(client, shards).rebalance(dry_run=dry_run)
+
+        if not summary:
+            print("✅ All subscribers are already on their shard")
+            return
+
+        for move in summary:
+            verb = "Would move" if dry_run else "Moved"
+            print(f"📦 {verb} {move['rows']} row(s) from shard {move['from_shard']} to shard {move['to_shard']}")
+
+        if not dry_run:
+            print("🎉 Rebalance completed")
+
+    except Exception as e:
+        print(f"❌ Error rebalancing shards: {e}")
+
+if __name__ == '__main__':
+    rebalance_shards(dry_run='--dry-run' in sys.argv)
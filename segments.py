@@ -0,0 +1,145 @@
+# Audience segmentation for campaigns. A segment is a JSON expression over
+# subscriber columns that is compiled once into a plain Python predicate and
+# then evaluated in a single streaming pass over the subscriber records.
+#
+# Examples:
+#   {"country": "united states"}
+#   {"region": {"in": ["california", "texas"]}}
+#   {"signup_date": {"gte": "2025-01-01", "lte": "2025-03-31"}}
+#   {"and": [{"country": "canada"}, {"not": {"city": "toronto"}}]}
+#   {"or": [{"email_domain": "gmail.com"}, {"lat": {"gt": 45}}]}
+
+# Segment field -> (sheet column, kind)
+FIELDS = {
+    'name': ('Name', 'text'),
+    'email': ('Email', 'text'),
+    'email_domain': ('Email', 'domain'),
+    'country': ('Country', 'text'),
+    'region': ('Region', 'text'),
+    'city': ('City', 'text'),
+    'ip_address': ('IP Address', 'text'),
+    'timestamp': ('Timestamp', 'text'),
+    'signup_date': ('Timestamp', 'date'),
+    'lat': ('Latitude', 'number'),
+    'latitude': ('Latitude', 'number'),
+    'lon': ('Longitude', 'number'),
+    'longitude': ('Longitude', 'number'),
+}
+
+OPERATORS = ('eq', 'ne', 'in', 'not_in', 'gt', 'gte', 'lt', 'lte', 'contains', 'startswith', 'endswith')
+STRING_OPERATORS = ('contains', 'startswith', 'endswith')
+
+
+class SegmentError(ValueError):
+    """Raised when a segment expression is malformed"""
+
+
+def _normalize(kind, value):
+    if kind == 'number':
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    value = str(value if value is not None else '').strip().lower()
+    if kind == 'date':
+        return value[:10]
+    if kind == 'domain':
+        return value.rsplit('@', 1)[-1]
+    return value
+
+
+def _compile_condition(field, condition):
+    if field not in FIELDS:
+        raise SegmentError(f"Unknown segment field '{field}'")
+    column, kind = FIELDS[field]
+
+    if not isinstance(condition, dict):
+        condition = {'in': condition} if isinstance(condition, list) else {'eq': condition}
+    if not condition:
+        raise SegmentError(f"Empty condition for field '{field}'")
+
+    checks = []
+    for op, operand in condition.items():
+        if op not in OPERATORS:
+            raise SegmentError(f"Unknown operator '{op}' for field '{field}'")
+        if kind == 'number' and op in STRING_OPERATORS:
+            raise SegmentError(f"Operator '{op}' does not apply to number field '{field}'")
+        if op in ('in', 'not_in'):
+            if not isinstance(operand, list):
+                raise SegmentError(f"Operator '{op}' for field '{field}' expects a list")
+            values = frozenset(_normalize(kind, v) for v in operand)
+            checks.append((lambda x, vs=values: x in vs) if op == 'in' else (lambda x, vs=values: x not in vs))
+            continue
+
+        target = _normalize(kind, operand)
+        if target is None:
+            raise SegmentError(f"Operator '{op}' for field '{field}' expects a number")
+        if op == 'eq':
+            checks.append(lambda x, t=target: x == t)
+        elif op == 'ne':
+            checks.append(lambda x, t=target: x != t)
+        elif op == 'gt':
+            checks.append(lambda x, t=target: x is not None and x > t)
+        elif op == 'gte':
+            checks.append(lambda x, t=target: x is not None and x >= t)
+        elif op == 'lt':
+            checks.append(lambda x, t=target: x is not None and x < t)
+        elif op == 'lte':
+            checks.append(lambda x, t=target: x is not None and x <= t)
+        elif op == 'contains':
+            checks.append(lambda x, t=target: x is not None and t in str(x))
+        elif op == 'startswith':
+            checks.append(lambda x, t=target: x is not None and str(x).startswith(t))
+        elif op == 'endswith':
+            checks.append(lambda x, t=target: x is not None and str(x).endswith(t))
+
+    def predicate(record):
+        value = _normalize(kind, record.get(column))
+        for check in checks:
+            if not check(value):
+                return False
+        return True
+
+    return predicate
+
+
+def _compile_child(key, child):
+    # Only a whole missing segment means "everyone"; a null or empty nested segment is a mistake
+    if not isinstance(child, dict) or not child:
+        raise SegmentError(f"'{key}' expects non-empty segment objects")
+    return compile_segment(child)
+
+
+def compile_segment(expression):
+    """Compile a segment expression into a predicate over get_all_records() dicts"""
+    if expression is None or expression == {}:
+        return lambda record: True
+    if not isinstance(expression, dict):
+        raise SegmentError("Segment must be a JSON object")
+
+    predicates = []
+    for key, value in expression.items():
+        if key in ('and', 'or'):
+            if not isinstance(value, list) or not value:
+                raise SegmentError(f"'{key}' expects a non-empty list of segments")
+            children = [_compile_child(key, child) for child in value]
+            if key == 'and':
+                predicates.append(lambda record, cs=children: all(c(record) for c in cs))
+            else:
+                predicates.append(lambda record, cs=children: any(c(record) for c in cs))
+        elif key == 'not':
+            child = _compile_child(key, value)
+            predicates.append(lambda record, c=child: not c(record))
+        else:
+            predicates.append(_compile_condition(key, value))
+
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda record: all(p(record) for p in predicates)
+
+
+def select_audience(records, predicate):
+    """Stream records through a compiled segment predicate"""
+    for record in records:
+        if predicate(record):
+            yield record
@@ -0,0 +1,199 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from resilience import resilient_call
+
+# Subscriber storage sharded across several spreadsheets (or worksheets). Each
+# subscriber lives on the shard chosen by a stable hash of the normalized email,
+# so lookups and deletes touch one shard while list reads fan out in parallel.
+
+HEADERS = [
+    'Name', 'Email', 'Timestamp', 'IP Address',
+    'Country', 'Region', 'City', 'Latitude', 'Longitude'
+]
+EMAIL_COLUMN_INDEX = 2
+# Row deletions sent per batch_update during a rebalance
+REBALANCE_DELETE_BATCH = 500
+
+
+def parse_shards(spec, default_sheet_id):
+    """Parse "id[/worksheet],id[/worksheet],..." into (spreadsheet_id, worksheet_title) pairs"""
+    shards = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        spreadsheet_id, _, worksheet_title = item.partition('/')
+        shards.append((spreadsheet_id, worksheet_title or None))
+    return shards or [(default_sheet_id, None)]
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def jump_hash(key, num_buckets):
+    """Jump consistent hash: growing from N to N+1 shards moves only 1/(N+1) of the keys"""
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_index(email, num_shards):
+    digest = hashlib.sha1(normalize_email(email).encode('utf-8')).digest()
+    return jump_hash(int.from_bytes(digest[:8], 'big'), num_shards)
+
+
+class ShardRouter:
+    """Route subscriber operations to the worksheet that owns each email"""
+
+    def __init__(self, client, shards):
+        self.client = client
+        self.shards = shards
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.shards)
+
+    def worksheet(self, index):
+        """Open (once per process) the worksheet for a shard, writing headers if it is empty"""
+        worksheet = self._worksheets.get(index)
+        if worksheet is not None:
+            return worksheet
+
+        spreadsheet_id, worksheet_title = self.shards[index]
+        spreadsheet = resilient_call('sheets', self.client.open_by_key, spreadsheet_id)
+        if worksheet_title:
+            worksheet = resilient_call('sheets', spreadsheet.worksheet, worksheet_title)
+        else:
+            worksheet = resilient_call('sheets', lambda: spreadsheet.sheet1)
+        if not resilient_call('sheets', worksheet.row_values, 1):
+            resilient_call('sheets', worksheet.append_row, HEADERS, idempotent=False)
+
+        with self._lock:
+            self._worksheets.setdefault(index, worksheet)
+        return self._worksheets[index]
+
+    def worksheet_for_email(self, email):
+        return self.worksheet(shard_index(email, len(self.shards)))
+
+    def find_row(self, email):
+        """Return (worksheet, row_number, row_values) for an email, or (worksheet, -1, []) if absent"""
+        normalized_email = normalize_email(email)
+        worksheet = self.worksheet_for_email(normalized_email)
+        all_emails = resilient_call('sheets', worksheet.col_values, EMAIL_COLUMN_INDEX)
+        for i, email_in_sheet in enumerate(all_emails):
+            if email_in_sheet.strip().lower() == normalized_email:
+                return worksheet, i + 1, resilient_call('sheets', worksheet.row_values, i + 1)
+        return worksheet, -1, []
+
+    def fan_out(self, fn):
+        """Call fn(worksheet) on every shard in parallel and return the results in shard order"""
+        if len(self.shards) == 1:
+            return [fn(self.worksheet(0))]
+        with ThreadPoolExecutor(max_workers=min(len(self.shards), 8)) as pool:
+            return list(pool.map(lambda i: fn(self.worksheet(i)), range(len(self.shards))))
+
+    def get_all_records(self):
+        records = []
+        for shard_records in self.fan_out(lambda ws: resilient_call('sheets', ws.get_all_records)):
+            records.extend(shard_records)
+        return records
+
+    def revision(self, drive_service):
+        """Combined Drive version of every shard spreadsheet; it changes on any edit"""
+        versions = []
+        for spreadsheet_id in sorted({spreadsheet_id for spreadsheet_id, _ in self.shards}):
+            request = drive_service.files().get(fileId=spreadsheet_id, fields='version')
+            metadata = resilient_call('drive', request.execute)
+            versions.append(f"{spreadsheet_id}@{metadata.get('version')}")
+        return f"{self.shards}|{','.join(versions)}"
+
+    def rebalance(self, dry_run=False):
+        """Move rows that live on the wrong shard to their owner.
+
+        Rows are appended to the owning shard (skipping emails it already has, so a
+        re-run after a partial failure adds no duplicates) before being deleted from
+        the old one. Deletes are sent as batch_update requests built from a fresh
+        read of the email column, so rows shifted by concurrent unsubscribes are
+        never hit by a stale row number.
+
+        Until it finishes, rows not yet moved are invisible to the duplicate check
+        in /subscribe and to /unsubscribe, which only look at the owning shard.
+        """
+        moves = {}
+        for source in range(len(self.shards)):
+            worksheet = self.worksheet(source)
+            rows = resilient_call('sheets', worksheet.get_all_values)
+            for row_number, row in enumerate(rows[1:], start=2):
+                if len(row) < EMAIL_COLUMN_INDEX or not row[EMAIL_COLUMN_INDEX - 1].strip():
+                    continue
+                target = shard_index(row[EMAIL_COLUMN_INDEX - 1], len(self.shards))
+                if target != source:
+                    moves.setdefault((source, target), []).append((row_number, row))
+
+        summary = [
+            {'from_shard': source, 'to_shard': target, 'rows': len(rows)}
+            for (source, target), rows in sorted(moves.items())
+        ]
+        if dry_run:
+            return summary
+
+        for (source, target), rows in sorted(moves.items()):
+            target_ws = self.worksheet(target)
+            existing = {
+                normalize_email(e)
+                for e in resilient_call('sheets', target_ws.col_values, EMAIL_COLUMN_INDEX)[1:]
+            }
+            missing = [row for _, row in rows if normalize_email(row[EMAIL_COLUMN_INDEX - 1]) not in existing]
+            if missing:
+                resilient_call('sheets', target_ws.append_rows, missing, idempotent=False)
+
+        moved_emails = {}
+        for (source, _), rows in moves.items():
+            moved_emails.setdefault(source, set()).update(
+                normalize_email(row[EMAIL_COLUMN_INDEX - 1]) for _, row in rows
+            )
+        for source, emails in moved_emails.items():
+            self._delete_rows_with_emails(self.worksheet(source), emails)
+        return summary
+
+    def _delete_rows_with_emails(self, worksheet, emails):
+        """Delete every row whose email is in emails, re-reading positions before each batch"""
+        while True:
+            # Row numbers are only trusted for the single batch_update that follows this read
+            current = resilient_call('sheets', worksheet.col_values, EMAIL_COLUMN_INDEX)
+            row_numbers = [i + 1 for i, e in enumerate(current) if i > 0 and normalize_email(e) in emails]
+            if not row_numbers:
+                return
+            # Requests in a batch_update apply in order, so going bottom-up keeps indexes valid
+            batch = sorted(row_numbers, reverse=True)[:REBALANCE_DELETE_BATCH]
+            body = {'requests': [
+                {'deleteDimension': {'range': {
+                    'sheetId': worksheet.id, 'dimension': 'ROWS',
+                    'startIndex': row_number - 1, 'endIndex': row_number,
+                }}}
+                for row_number in batch
+            ]}
+            resilient_call('sheets', worksheet.spreadsheet.batch_update, body, idempotent=False)
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_shard_router(client, default_sheet_id):
+    """Return the process-wide router for the shards configured in SUBSCRIBER_SHARDS"""
+    shards = parse_shards(os.getenv('SUBSCRIBER_SHARDS', ''), default_sheet_id)
+    key = (id(client), tuple(shards))
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = ShardRouter(client, shards)
+    return router
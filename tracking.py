@@ -0,0 +1,375 @@
+import os
+import re
+import hmac
+import json
+import time
+import zlib
+import atexit
+import base64
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import deque
+from html import unescape
+from urllib.parse import quote
+
+# Open/click tracking for campaign mail. Campaign HTML gets a tracking pixel and
+# links rewritten through /t/click, each carrying an HMAC-signed token, so the
+# tracking endpoints need no lookups: they verify the token, bump in-memory
+# per-campaign counters and append the event to a bounded ring buffer. A
+# background thread flushes the buffer in batches to SQLite, where each batch is
+# stored column by column (one compressed chunk per column), and a small
+# batch_campaigns index records which campaigns each batch holds so per-campaign
+# reads only decompress the batches they need.
+#
+# Tokens identify recipients by a keyed hash of the email (see recipient_id), so
+# addresses never appear in tracking URLs or in the proxy/CDN logs that record them.
+#
+# Counters and events are per process: with several instances, each one only
+# sees the hits it served, and a /tmp TRACKING_DB_PATH is lost on scale-down.
+
+TRACKING_BASE_URL = os.getenv('TRACKING_BASE_URL', '').rstrip('/')
+TRACKING_SECRET = os.getenv('TRACKING_SECRET', '')
+TRACKING_DB_PATH = os.getenv('TRACKING_DB_PATH', '/tmp/subscriber_tracking.db')
+TRACKING_BUFFER_SIZE = int(os.getenv('TRACKING_BUFFER_SIZE', '65536'))
+TRACKING_FLUSH_BATCH = int(os.getenv('TRACKING_FLUSH_BATCH', '2048'))
+TRACKING_FLUSH_INTERVAL = float(os.getenv('TRACKING_FLUSH_INTERVAL', '5'))
+
+OPEN = 'o'
+CLICK = 'c'
+
+# 1x1 transparent GIF
+PIXEL_GIF = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+_SIGNATURE_BYTES = 16
+_LINK = re.compile(r"""(<a\b[^>]*?\bhref\s*=\s*)(["'])(https?://[^"']+)\2""", re.IGNORECASE)
+_BODY_CLOSE = re.compile(r'</body\s*>', re.IGNORECASE)
+
+
+def tracking_enabled():
+    return bool(TRACKING_BASE_URL and TRACKING_SECRET)
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _secret(secret):
+    # An empty key would let anyone mint valid tokens (and so use /t/click as an open redirect)
+    secret = secret or TRACKING_SECRET
+    if not secret:
+        raise ValueError('TRACKING_SECRET is not configured')
+    return secret.encode('utf-8')
+
+
+def _sign(payload, secret):
+    return hmac.new(_secret(secret), payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+
+
+def recipient_id(email, secret=None):
+    """Opaque, stable id for a recipient: a keyed hash, so tokens never carry the address"""
+    email = (email or '').strip().lower()
+    if not email:
+        return ''
+    digest = hmac.new(_secret(secret), b'recipient\x1f' + email.encode('utf-8'), hashlib.sha256).digest()
+    return _b64encode(digest[:12])
+
+
+def make_token(kind, campaign, email, url='', secret=None):
+    payload = '\x1f'.join([kind, campaign or '', recipient_id(email, secret), url]).encode('utf-8')
+    return _b64encode(payload) + '.' + _b64encode(_sign(payload, secret))
+
+
+def verify_token(token, expected_kind, secret=None):
+    """Return (campaign, recipient_id, url) for a validly signed token of expected_kind, else None"""
+    if not (secret or TRACKING_SECRET):
+        return None
+    try:
+        payload_part, signature_part = (token or '').split('.', 1)
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, TypeError):
+        return None
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        return None
+    fields = payload.decode('utf-8', 'replace').split('\x1f')
+    if len(fields) != 4 or fields[0] != expected_kind:
+        return None
+    return fields[1], fields[2], fields[3]
+
+
+def rewrite_links(html_content, campaign, email, base_url=None):
+    """Route every http(s) link through /t/click with a signed token"""
+    base_url = base_url or TRACKING_BASE_URL
+
+    def rewrite(match):
+        token = make_token(CLICK, campaign, email, unescape(match.group(3)))
+        return f'{match.group(1)}{match.group(2)}{base_url}/t/click?t={quote(token)}{match.group(2)}'
+
+    return _LINK.sub(rewrite, html_content)
+
+
+def instrument_html(html_content, campaign, email, base_url=None):
+    """Rewrite links and add the open-tracking pixel for one recipient"""
+    base_url = base_url or TRACKING_BASE_URL
+    html_content = rewrite_links(html_content, campaign, email, base_url)
+    pixel = (f'<img src="{base_url}/t/open?t={quote(make_token(OPEN, campaign, email))}" '
+             f'width="1" height="1" alt="" style="display:block;border:0;width:1px;height:1px;">')
+    matches = list(_BODY_CLOSE.finditer(html_content))
+    if matches:
+        position = matches[-1].start()
+        return html_content[:position] + pixel + html_content[position:]
+    return html_content + pixel
+
+
+def _encode_column(values):
+    """Dictionary-encode a string column: distinct values plus one index per row"""
+    dictionary, indices = {}, array('I')
+    for value in values:
+        indices.append(dictionary.setdefault(value, len(dictionary)))
+    return zlib.compress(json.dumps(list(dictionary)).encode('utf-8') + b'\x00' + indices.tobytes())
+
+
+def _decode_column(blob):
+    raw = zlib.decompress(blob)
+    separator = raw.index(b'\x00')
+    dictionary = json.loads(raw[:separator])
+    indices = array('I')
+    indices.frombytes(raw[separator + 1:])
+    return [dictionary[i] for i in indices]
+
+
+class EngagementTracker:
+    """Ring-buffered open/click ingestion with incrementally maintained campaign counters"""
+
+    COUNTERS = ('queued', 'opens', 'clicks', 'unique_opens', 'unique_clicks')
+
+    def __init__(self, path=TRACKING_DB_PATH, buffer_size=TRACKING_BUFFER_SIZE,
+                 flush_batch=TRACKING_FLUSH_BATCH, flush_interval=TRACKING_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_wanted = threading.Event()
+        self._flusher = None
+        self.dropped = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets event reads run on their own connection while the flusher writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS event_batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_count INTEGER NOT NULL,
+                first_ts REAL NOT NULL,
+                last_ts REAL NOT NULL,
+                ts BLOB NOT NULL,
+                kind BLOB NOT NULL,
+                campaign BLOB NOT NULL,
+                recipient BLOB NOT NULL,
+                url BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS batch_campaigns (
+                campaign TEXT NOT NULL,
+                batch_id INTEGER NOT NULL,
+                PRIMARY KEY (campaign, batch_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS engaged_recipients (
+                campaign TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                PRIMARY KEY (campaign, kind, recipient)
+            );
+            CREATE TABLE IF NOT EXISTS campaign_counters (
+                campaign TEXT PRIMARY KEY,
+                queued INTEGER NOT NULL DEFAULT 0,
+                opens INTEGER NOT NULL DEFAULT 0,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                unique_opens INTEGER NOT NULL DEFAULT 0,
+                unique_clicks INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        # Index batches written before batch_campaigns existed
+        for batch_id, campaign_blob in self._conn.execute(
+            "SELECT id, campaign FROM event_batches "
+            "WHERE id > (SELECT COALESCE(MAX(batch_id), 0) FROM batch_campaigns)"
+        ).fetchall():
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO batch_campaigns (campaign, batch_id) VALUES (?, ?)",
+                [(campaign, batch_id) for campaign in set(_decode_column(campaign_blob))],
+            )
+        self._conn.commit()
+        # Live counters start from the persisted totals; unflushed events only live here
+        self._counters = {
+            row[0]: dict(zip(self.COUNTERS, row[1:]))
+            for row in self._conn.execute(
+                "SELECT campaign, queued, opens, clicks, unique_opens, unique_clicks FROM campaign_counters"
+            )
+        }
+        atexit.register(self.flush)
+
+    def _campaign_counters(self, campaign):
+        counters = self._counters.get(campaign)
+        if counters is None:
+            counters = self._counters[campaign] = dict.fromkeys(self.COUNTERS, 0)
+        return counters
+
+    def record(self, kind, campaign, recipient, url=''):
+        """Record one open or click; O(1) and never blocks on storage"""
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append((time.time(), kind, campaign, recipient, url))
+            self._campaign_counters(campaign)['opens' if kind == OPEN else 'clicks'] += 1
+            pending = len(self._buffer)
+        if pending >= self.flush_batch:
+            self._flush_wanted.set()
+        self.start()
+
+    def record_queued(self, campaign, count):
+        with self._lock:
+            self._campaign_counters(campaign)['queued'] += count
+        with self._flush_lock:
+            self._conn.execute("INSERT OR IGNORE INTO campaign_counters (campaign) VALUES (?)", (campaign,))
+            self._conn.execute(
+                "UPDATE campaign_counters SET queued = queued + ? WHERE campaign = ?", (count, campaign)
+            )
+            self._conn.commit()
+
+    def flush(self):
+        """Write buffered events as one column-chunked batch and fold them into the counters"""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+            if not events:
+                return 0
+
+            timestamps, kinds, campaigns, recipients, urls = zip(*events)
+            batch_id = self._conn.execute(
+                "INSERT INTO event_batches (event_count, first_ts, last_ts, ts, kind, campaign, recipient, url) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (len(events), min(timestamps), max(timestamps),
+                 zlib.compress(array('d', timestamps).tobytes()),
+                 zlib.compress(''.join(kinds).encode('ascii')),
+                 _encode_column(campaigns), _encode_column(recipients), _encode_column(urls)),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO batch_campaigns (campaign, batch_id) VALUES (?, ?)",
+                [(campaign, batch_id) for campaign in set(campaigns)],
+            )
+
+            deltas, unique_deltas = {}, {}
+            for _, kind, campaign, recipient, _ in events:
+                delta = deltas.setdefault(campaign, [0, 0, 0, 0])
+                delta[0 if kind == OPEN else 1] += 1
+                if recipient and self._conn.execute(
+                    "INSERT OR IGNORE INTO engaged_recipients (campaign, kind, recipient) VALUES (?, ?, ?)",
+                    (campaign, kind, recipient),
+                ).rowcount:
+                    delta[2 if kind == OPEN else 3] += 1
+                    unique_deltas.setdefault(campaign, [0, 0])[0 if kind == OPEN else 1] += 1
+
+            for campaign, (opens, clicks, unique_opens, unique_clicks) in deltas.items():
+                self._conn.execute("INSERT OR IGNORE INTO campaign_counters (campaign) VALUES (?)", (campaign,))
+                self._conn.execute(
+                    "UPDATE campaign_counters SET opens = opens + ?, clicks = clicks + ?, "
+                    "unique_opens = unique_opens + ?, unique_clicks = unique_clicks + ? WHERE campaign = ?",
+                    (opens, clicks, unique_opens, unique_clicks, campaign),
+                )
+            self._conn.commit()
+
+            # Uniqueness is only known once the batch hits the store
+            with self._lock:
+                for campaign, (unique_opens, unique_clicks) in unique_deltas.items():
+                    counters = self._campaign_counters(campaign)
+                    counters['unique_opens'] += unique_opens
+                    counters['unique_clicks'] += unique_clicks
+            return len(events)
+
+    def _run_flusher(self):
+        while True:
+            self._flush_wanted.wait(timeout=self.flush_interval)
+            self._flush_wanted.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Failed to flush tracking events: {e}")
+
+    def start(self):
+        """Start the background flusher if it isn't running yet"""
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                    self._flusher.start()
+
+    def stats(self, campaign=None):
+        with self._lock:
+            items = [(campaign, self._counters.get(campaign))] if campaign else list(self._counters.items())
+            campaigns = []
+            for name, counters in items:
+                if counters is None:
+                    continue
+                entry = {'campaign_id': name, **counters}
+                queued = counters['queued']
+                entry['open_rate'] = round(counters['unique_opens'] / queued, 4) if queued else None
+                entry['click_rate'] = round(counters['unique_clicks'] / queued, 4) if queued else None
+                campaigns.append(entry)
+            return {'campaigns': campaigns, 'buffered_events': len(self._buffer), 'dropped_events': self.dropped}
+
+    def iter_events(self, campaign=None, limit=None):
+        """Yield up to limit flushed (ts, kind, campaign, recipient_id, url) events, newest first.
+
+        Reads use their own connection and never take the flush lock, and batches
+        are fetched lazily, so only as many are decompressed as limit requires.
+        """
+        if limit is not None and limit <= 0:
+            return
+        conn = sqlite3.connect(self.path)
+        try:
+            if campaign is None:
+                batches = conn.execute(
+                    "SELECT ts, kind, campaign, recipient, url FROM event_batches ORDER BY id DESC"
+                )
+            else:
+                batches = conn.execute(
+                    "SELECT b.ts, b.kind, b.campaign, b.recipient, b.url FROM batch_campaigns bc "
+                    "JOIN event_batches b ON b.id = bc.batch_id WHERE bc.campaign = ? "
+                    "ORDER BY bc.batch_id DESC",
+                    (campaign,),
+                )
+            for ts_blob, kind_blob, campaign_blob, recipient_blob, url_blob in batches:
+                timestamps = array('d')
+                timestamps.frombytes(zlib.decompress(ts_blob))
+                kinds = zlib.decompress(kind_blob).decode('ascii')
+                columns = (timestamps, kinds, _decode_column(campaign_blob),
+                           _decode_column(recipient_blob), _decode_column(url_blob))
+                for event in reversed(list(zip(*columns))):
+                    if campaign is None or event[2] == campaign:
+                        yield event
+                        if limit is not None:
+                            limit -= 1
+                            if limit == 0:
+                                return
+        finally:
+            conn.close()
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = EngagementTracker()
+    return _tracker